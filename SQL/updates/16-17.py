@@ -11,8 +11,13 @@
 import mysql.connector
 import argparse
 import struct, socket
+import sys
 import time
 from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "tools" / "pr_sql"))
+from batch_migration import BATCH_SIZE, Progress, insert_rows, iter_batches
 
 parser = argparse.ArgumentParser()
 parser.add_argument("address", help="MySQL server address (use localhost for the current computer)")
@@ -29,9 +34,6 @@ current_table = args.curtable
 new_table = args.newtable
 
 # Populate the target table with legacy data.
-cursor.execute("SELECT round_id, var_name, details FROM {0} WHERE var_name IN ( \
-'round_start', 'round_end', 'server_ip', 'game_mode', 'round_end_result' )".format(current_table))
-
 var_name_mapping = {
 	'round_start': 'start_datetime',
 	'round_end': 'end_datetime',
@@ -42,38 +44,42 @@ var_name_mapping = {
 
 rounds = {}
 
-rows = cursor.fetchall()
-print("Found ", len(rows), "rows to parse.")
-for row in rows:
-	round_id = row[0]
-	var_name = row[1]
-	details = row[2]
-
-	if not round_id in rounds:
-		rounds[round_id] = {}
-
-	rounds_obj = rounds[round_id]
-	if not var_name_mapping[var_name] in rounds_obj:
-		if var_name == 'round_start':
-			# 'Wed Mar 21 23:55:05 2018'
-			date_obj = datetime.strptime(details, "%a %b %d %H:%M:%S %Y")
-			rounds_obj[var_name_mapping[var_name]] = date_obj
-			rounds_obj['initialize_datetime'] = date_obj
-		elif var_name == 'round_end':
-			date_obj = datetime.strptime(details, "%a %b %d %H:%M:%S %Y")
-			rounds_obj[var_name_mapping[var_name]] = date_obj
-			rounds_obj['shutdown_datetime'] = date_obj
-		elif var_name == 'server_ip':
-			server_ip_arr = details.split(':')
-			if not server_ip_arr[0]:
-				server_ip_arr[0] = '0.0.0.0'
-			rounds_obj['server_ip'] = struct.unpack("!I", socket.inet_aton(server_ip_arr[0]))[0]
-			rounds_obj['server_port'] = int(server_ip_arr[1])
-		else:
-			rounds_obj[var_name_mapping[var_name]] = details
+progress = Progress("Parsing rows")
+for rows in iter_batches(db, current_table, ["id", "round_id", "var_name", "details"], where="var_name IN ( \
+'round_start', 'round_end', 'server_ip', 'game_mode', 'round_end_result' )"):
+	for row in rows:
+		round_id = row[1]
+		var_name = row[2]
+		details = row[3]
+
+		if not round_id in rounds:
+			rounds[round_id] = {}
+
+		rounds_obj = rounds[round_id]
+		if not var_name_mapping[var_name] in rounds_obj:
+			if var_name == 'round_start':
+				# 'Wed Mar 21 23:55:05 2018'
+				date_obj = datetime.strptime(details, "%a %b %d %H:%M:%S %Y")
+				rounds_obj[var_name_mapping[var_name]] = date_obj
+				rounds_obj['initialize_datetime'] = date_obj
+			elif var_name == 'round_end':
+				date_obj = datetime.strptime(details, "%a %b %d %H:%M:%S %Y")
+				rounds_obj[var_name_mapping[var_name]] = date_obj
+				rounds_obj['shutdown_datetime'] = date_obj
+			elif var_name == 'server_ip':
+				server_ip_arr = details.split(':')
+				if not server_ip_arr[0]:
+					server_ip_arr[0] = '0.0.0.0'
+				rounds_obj['server_ip'] = struct.unpack("!I", socket.inet_aton(server_ip_arr[0]))[0]
+				rounds_obj['server_port'] = int(server_ip_arr[1])
+			else:
+				rounds_obj[var_name_mapping[var_name]] = details
+	progress.add(len(rows))
+progress.finish()
 
 print("Assembled objects for", len(rounds) ,"rounds.")
 
+new_rows = []
 for round in rounds:
 	round_id = round
 	round_obj = rounds[round]
@@ -91,13 +97,16 @@ for round in rounds:
 		# print("Round lost:", round_id, round_obj)
 		continue
 
-	cursor.execute("SELECT EXISTS(SELECT id FROM {0} WHERE id = {1})".format(new_table, round_id))
-	exists = cursor.fetchone()[0]
-	if not exists:
-		args = (round_id, initialize_datetime, start_datetime, end_datetime, server_ip, server_port, game_mode, game_mode_result)
-		query = "INSERT INTO {0} (id, initialize_datetime, start_datetime, end_datetime, server_ip, server_port, game_mode, game_mode_result) \
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s)".format(new_table)
-		cursor.execute(query, args)
+	new_rows.append((round_id, initialize_datetime, start_datetime, end_datetime, server_ip, server_port, game_mode, game_mode_result))
+
+# Rounds which already exist in the new table are left alone.
+columns = ["id", "initialize_datetime", "start_datetime", "end_datetime", "server_ip", "server_port", "game_mode", "game_mode_result"]
+progress = Progress("Inserting rounds", len(new_rows))
+for i in range(0, len(new_rows), BATCH_SIZE):
+	batch = new_rows[i:i + BATCH_SIZE]
+	insert_rows(cursor, new_table, columns, batch, update=[])
+	db.commit()
+	progress.add(len(batch))
+progress.finish()
 
 cursor.close()
-db.commit()
@@ -14,7 +14,8 @@
 #
 #The script has been tested to complete with Paradise's feedback table as of 2020-12-21
 #Due to the complexity of data that has potentially changed formats multiple times and suffered errors when recording I cannot guarantee it'll always execute successfully
-#In the event of an error the new feedback table is automatically truncated
+#Progress is saved after every batch of rows, so if the script stops or hits an error, running it again carries on from where it stopped
+#To throw away the saved progress and start over with an empty new table, run it with --restart
 #The source table is never modified so you don't have to worry about losing any data due to errors
 #Note that some feedback keys are renamed or coalesced into one, additionnaly some have been entirely removed
 #
@@ -27,6 +28,10 @@ import json
 import re
 import sys
 from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "tools" / "pr_sql"))
+from batch_migration import Checkpoints, Progress, count_rows, insert_rows
 
 def parse_text(details):
     if not details:
@@ -464,8 +469,9 @@ key_types = {"amount":["ais_created", "immortality_talisman_uses", "mmis_filled"
 "tally":[ "admin_secrets_fun_used", "admin_verb", "ahelp_stats", "assembly_made", "brother_success", "cell_used", "changeling_power_purchase", "changeling_success", "chemical_reaction", "circuit_printed", "clockcult_scripture_recited", "contamination", "cult_runes_scribed", "cyborg_modules", "engine_started", "event_admin_cancelled", "event_ran", "food_harvested", "food_made", "gun_fired", "handcuffs", "item_deconstructed", "item_printed", "jaunter", "lazarus_injector", "mechas_created", "mining_voucher_redeemed", "mobs_killed_mining", "object_crafted", "ore_mined", "pick_used_mining", "radio_usage", "security_level_changes", "shuttle_gib", "slime_babies_born", "slime_cores_used", "slime_core_harvested", "surgeries_completed", "time_dilation_current", "traitor_random_uplink_items_gotten", "traitor_success", "voice_of_god", "warp_cube", "wisp_lantern", "wizard_spell_learned", "wizard_success", "zone_targeted", "employee_success"],
 "text":["shuttle_fasttravel", "shuttle_manipulator", "shuttle_purchase", "shuttle_reason", "religion_book", "religion_deity", "religion_name", "station_renames", "chaplain_weapon"]}
 multirows_completed = []
-query_values = ""
+new_rows = []
 current_round = 0
+current_id = None
 parser = argparse.ArgumentParser()
 parser.add_argument("address", help="MySQL server address (use localhost for the current computer)")
 parser.add_argument("username", help="MySQL login username")
@@ -473,35 +479,41 @@ parser.add_argument("password", help="MySQL login password")
 parser.add_argument("database", help="Database name")
 parser.add_argument("curtable", help="Name of the current feedback table (remember prefixes if you use them)")
 parser.add_argument("newtable", help="Name of the new table to insert to, can't be same as the source table (remember prefixes)")
+parser.add_argument("--restart", action="store_true", help="Discard the progress of an earlier run and truncate the new table")
 args = parser.parse_args()
 db=mysql.connector.connect(host=args.address, user=args.username, passwd=args.password, db=args.database)
 cursor=db.cursor()
 current_table = args.curtable
 new_table = args.newtable
-cursor.execute("SELECT max(id) FROM {0}".format(current_table))
-query_id = cursor.fetchone()
-max_id = query_id[0]
+checkpoints = Checkpoints(db, "17-18")
+if args.restart:
+    checkpoints.reset()
+    cursor.execute("TRUNCATE {0}".format(new_table))
+state = checkpoints.state(new_table)
+if "written" not in state:
+    # Record where the new table starts before the first batch, so that batch can be cleaned up too if it doesn't finish
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM {0}".format(new_table))
+    state["written"] = cursor.fetchone()[0]
+    state["round"] = current_round
+    state["multirows_completed"] = []
+    checkpoints.save(cursor, new_table)
+    db.commit()
+# The new table is MyISAM, so rows inserted by a batch which didn't finish weren't rolled back with it
+cursor.execute("DELETE FROM {0} WHERE id > %s".format(new_table), (state["written"],))
+db.commit()
+current_round = state["round"]
+multirows_completed.extend(state["multirows_completed"])
 start_time = datetime.now()
 print("Beginning conversion at {0}".format(start_time.strftime("%Y-%m-%d %H:%M:%S")), flush = True)
 try:
     # This is a range from 820,000 UPWARDS. Paradise feedback was flushed on 2018-03-22, and the row ID of the new start is around the 820k range
-    # The script can handle empty rows just fine (and in this case, does), this just saves a LOT of time and useless querying -aa
-    for current_id in range(820000, max_id):
-        if current_id % 10000 == 0:
-            cur_time = datetime.now()
-            print("Reached row ID {0} Duration: {1}".format(current_id, cur_time - start_time), flush = True)
-        cursor.execute("SELECT * FROM {0} WHERE id = {1}".format(current_table, current_id))
-        query_row = cursor.fetchone()
-        if not query_row:
-            continue
-        else:
+    # Rows are read a batch at a time in ID order, and each batch is converted, inserted and committed along with a checkpoint before the next is read
+    progress = Progress("Converting rows", count_rows(db, current_table, "id >= 820000"))
+    for query_rows in checkpoints.batches(new_table, current_table, ["*"], where="id >= 820000"):
+        for query_row in query_rows:
+            current_id = query_row[0]
             if current_round != query_row[2]:
                 multirows_completed.clear()
-                if query_values:
-                    query_values = query_values[:-1]
-                    query_values += ';'
-                    cursor.execute("INSERT INTO {0} (datetime, round_id, key_name, key_type, version, json) VALUES {1}".format(new_table, query_values))
-                    query_values = ""
             current_round = query_row[2]
             if query_row[3] in multirows_completed:
                 continue
@@ -520,8 +532,16 @@ try:
                 if new_key in key_types[t]:
                     new_key_type = t
                     break
-            dequoted_json = re.sub("\'", "\\'", json.dumps(json_data))
-            query_values += "('{0}',{1},'{2}','{3}',{4},'{5}'),".format(query_row[1], query_row[2], new_key, new_key_type, 1, dequoted_json)
+            new_rows.append((query_row[1], query_row[2], new_key, new_key_type, 1, json.dumps(json_data)))
+        insert_rows(cursor, new_table, ["datetime", "round_id", "key_name", "key_type", "version", "json"], new_rows)
+        new_rows.clear()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM {0}".format(new_table))
+        state["written"] = cursor.fetchone()[0]
+        state["round"] = current_round
+        state["multirows_completed"] = list(multirows_completed)
+        progress.add(len(query_rows))
+    progress.finish()
+    checkpoints.finish()
     end_time = datetime.now()
     print("Conversion completed at {0}".format(datetime.now().strftime("%Y-%m-%d %H:%M:%S")), flush = True)
     print("Script duration: {0}".format(end_time - start_time), flush = True)
@@ -529,7 +549,7 @@ except Exception as e:
     end_time = datetime.now()
     print("Error encountered on row ID {0} at {1}".format(current_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")), flush = True)
     print("Script duration: {0}".format(end_time - start_time), flush = True)
-    cursor.execute("TRUNCATE {0} ".format(new_table))
+    print("Progress up to the last completed batch has been saved, run the script again to carry on from there", flush = True)
     raise e
 cursor.close()
 db.commit()
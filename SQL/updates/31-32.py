@@ -9,7 +9,11 @@
 
 #!/usr/bin/env python3
 import mysql.connector, argparse
-from mysql.connector.errors import IntegrityError
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "tools" / "pr_sql"))
+from batch_migration import Progress, count_rows, insert_rows, iter_batches
 
 parser = argparse.ArgumentParser()
 parser.add_argument("address", help="MySQL server address (use localhost for the current computer)")
@@ -44,55 +48,64 @@ species_purchase_map = {
 
 print("Connected")
 
-cursor.execute("SELECT ckey, job, species FROM whitelist")
-data = cursor.fetchall()
-
-print("Loaded {} rows from old table".format(len(data)))
-
-new_rows = []
-
-for entry in data:
-    job_set = entry[1]
-    species_set = entry[2]
-
-    # Account for null entries
-    if job_set is not None:
-        jobs = job_set.split(",")
-    else:
-        jobs = []
-
-    if species_set is not None:
-        species = species_set.split(",")
-    else:
-        species = []
-
-    if len(jobs) > 0:
-        for job in jobs:
-            if job in job_purchase_map:
-                new_job = job_purchase_map[job]
-                new_row = [entry[0], new_job]
-                new_rows.append(new_row)
-
-    if len(species) > 0:
-        for race in species:
-            if race in species_purchase_map:
-                new_species = species_purchase_map[race]
-                new_row = [entry[0], new_species]
-                new_rows.append(new_row)
-
-print("Generated {} rows to insert into new table".format(len(new_rows)))
-
-stmt = "INSERT INTO karma_purchases (ckey, purchase) VALUES (%s, %s)"
-
-print("Inserting...")
-for row in new_rows:
-    data = (row[0], row[1])
-    try:
-        cursor.execute(stmt, data)
-    except IntegrityError:
-        print("{} already had {} as a purchase. They may be eligble for compensation".format(row[0], row[1])) # They had an accident that wasnt their fault
+progress = Progress("Converting whitelist", count_rows(db, "whitelist"))
+inserted = 0
+
+for data in iter_batches(db, "whitelist", ["id", "ckey", "job", "species"]):
+    new_rows = []
+
+    for entry in data:
+        ckey = entry[1]
+        job_set = entry[2]
+        species_set = entry[3]
+
+        # Account for null entries
+        if job_set is not None:
+            jobs = job_set.split(",")
+        else:
+            jobs = []
+
+        if species_set is not None:
+            species = species_set.split(",")
+        else:
+            species = []
+
+        if len(jobs) > 0:
+            for job in jobs:
+                if job in job_purchase_map:
+                    new_job = job_purchase_map[job]
+                    new_row = (ckey, new_job)
+                    new_rows.append(new_row)
+
+        if len(species) > 0:
+            for race in species:
+                if race in species_purchase_map:
+                    new_species = species_purchase_map[race]
+                    new_row = (ckey, new_species)
+                    new_rows.append(new_row)
+
+    # Look up which of this batch's purchases already exist, so they can be reported instead of inserted
+    existing = set()
+    if new_rows:
+        ckeys = sorted({row[0] for row in new_rows})
+        cursor.execute("SELECT ckey, purchase FROM karma_purchases WHERE ckey IN ({})".format(", ".join(["%s"] * len(ckeys))), ckeys)
+        existing = set(cursor.fetchall())
+
+    to_insert = []
+    for row in new_rows:
+        if row in existing:
+            print("{} already had {} as a purchase. They may be eligble for compensation".format(row[0], row[1])) # They had an accident that wasnt their fault
+        else:
+            existing.add(row)
+            to_insert.append(row)
+
+    # IGNORE as well, in case the table's case insensitive collation finds a duplicate the check above didn't
+    inserted += insert_rows(cursor, "karma_purchases", ["ckey", "purchase"], to_insert, ignore=True)
+    db.commit()
+    progress.add(len(data))
+
+progress.finish()
+print("Inserted {} rows into new table".format(inserted))
 
 cursor.close()
-print("Saving...")
-db.commit()
 print("Done!")
@@ -10,6 +10,11 @@
 
 import json
 import mysql.connector, argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "tools" / "pr_sql"))
+from batch_migration import BATCH_SIZE, Progress, insert_rows, iter_batches
 
 def main():
     parser = argparse.ArgumentParser()
@@ -31,8 +36,10 @@ def main():
         "Religion": 3,
     }
 
-    cursor.execute("SELECT id, author, title, content, category, ckey FROM library_old")
-    data = cursor.fetchall()
+    # every book is needed at once to find duplicates, but they're still read a batch at a time
+    data = []
+    for rows in iter_batches(db, "library_old", ["id", "author", "title", "content", "category", "ckey"]):
+        data.extend(rows)
 
     print("Loaded {} rows from library table...".format(len(data)))
 
@@ -115,14 +122,16 @@ def main():
 
 
     print("Inserting...")
-    for row in new_rows:
-        params = [row[1], row[2], row[3], "", row[4], row[5], "", ""] #empty strings since some columns don't have default vals
-        sql_query = "INSERT INTO library (author, title, content, summary, primary_category, ckey, reports, raters) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-        cursor.execute(sql_query, params)
+    columns = ["author", "title", "content", "summary", "primary_category", "ckey", "reports", "raters"]
+    progress = Progress("Inserting books", len(new_rows))
+    for i in range(0, len(new_rows), BATCH_SIZE):
+        batch = [(row[1], row[2], row[3], "", row[4], row[5], "", "") for row in new_rows[i:i + BATCH_SIZE]] #empty strings since some columns don't have default vals
+        insert_rows(cursor, "library", columns, batch)
+        db.commit()
+        progress.add(len(batch))
+    progress.finish()
 
     cursor.close()
-    print("Saving...")
-    db.commit()
     print("Done!")
 
 #this is a script not a library
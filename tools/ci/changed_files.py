@@ -0,0 +1,57 @@
+# Helpers for running per-file CI checks against only the files that changed
+# since a given git revision, so that pre-commit and PR runs don't have to scan
+# the whole codebase.
+#
+# Usage from a check script:
+#
+#   parser = argparse.ArgumentParser()
+#   changed_files.add_arguments(parser)
+#   args = parser.parse_args()
+#   dm_files = changed_files.resolve(args, "**/*.dm")
+#
+# The script can then be run as any of:
+#
+#   python tools/ci/check_grep2.py
+#   python tools/ci/check_grep2.py code/foo.dm code/bar.dm
+#   python tools/ci/check_grep2.py --since origin/master
+import fnmatch
+import glob
+import os
+import subprocess
+
+
+def add_arguments(parser):
+    parser.add_argument("files", nargs="*", help="files to check (default: the whole codebase)")
+    parser.add_argument("--since", metavar="REV", help="only check files changed since the given git revision")
+
+
+def _git_lines(*args):
+    result = subprocess.run(["git", *args], capture_output=True, text=True, check=True)
+    return [line for line in result.stdout.splitlines() if line]
+
+
+def _matches(path, pattern):
+    # glob's "**/" can also match zero directories, fnmatch's "*" already spans them
+    return fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(path, pattern.replace("**/", ""))
+
+
+def changed_since(revision, pattern):
+    """
+    Return the files matching `pattern` which were added, modified or renamed
+    between `revision` and the working tree, including untracked files.
+    """
+    files = _git_lines("diff", "--name-only", "--relative", "--diff-filter=ACMR", revision, "--")
+    files += _git_lines("ls-files", "--others", "--exclude-standard")
+    return sorted({os.path.normpath(f) for f in files if _matches(f, pattern)})
+
+
+def resolve(args, pattern):
+    """
+    Pick the list of files to check from parsed command line arguments:
+    explicit files win, then `--since`, then everything matching `pattern`.
+    """
+    if args.files:
+        return args.files
+    if args.since:
+        return changed_since(args.since, pattern)
+    return glob.glob(pattern, recursive=True)
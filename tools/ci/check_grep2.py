@@ -1,10 +1,12 @@
-import glob
+import argparse
 import re
 import os
 import sys
 import time
 from collections import namedtuple
 
+import changed_files
+
 Failure = namedtuple("Failure", ["filename", "lineno", "message"])
 
 RED = "\033[0;31m"
@@ -208,15 +210,16 @@ CODE_CHECKS = [
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    changed_files.add_arguments(parser)
+    args = parser.parse_args()
+
     print("check_grep2 started")
 
     exit_code = 0
     start = time.time()
 
-    dm_files = glob.glob("**/*.dm", recursive=True)
-
-    if len(sys.argv) > 1:
-        dm_files = [sys.argv[1]]
+    dm_files = changed_files.resolve(args, "**/*.dm")
 
     all_failures = []
 
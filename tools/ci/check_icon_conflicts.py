@@ -1,4 +1,5 @@
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import glob
 import sys
 import time
@@ -6,6 +7,11 @@ import time
 from ..dmi import Dmi
 
 
+def find_conflicted_states(dmi_path):
+    dmi = Dmi.read_metadata(dmi_path)
+    return [state.name for state in dmi.states if '!CONFLICT!' in state.name]
+
+
 if __name__ == "__main__":
     print("check_icon_conflicts started")
 
@@ -15,12 +21,12 @@ if __name__ == "__main__":
 
     findings = defaultdict(list)
 
-    for dmi_path in glob.glob("**/*.dmi", recursive=True):
-        dmi = Dmi.from_file(dmi_path)
-        for state in dmi.states:
-            if '!CONFLICT!' in state.name:
-                findings[dmi_path].append(state.name)
-        count += 1
+    dmi_paths = glob.glob("**/*.dmi", recursive=True)
+    with ProcessPoolExecutor() as executor:
+        for dmi_path, conflicted in zip(dmi_paths, executor.map(find_conflicted_states, dmi_paths, chunksize=32)):
+            if conflicted:
+                findings[dmi_path] += conflicted
+            count += 1
 
     if findings:
         exit_code = 1
@@ -1,4 +1,5 @@
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import glob
 import sys
 import time
@@ -6,6 +7,18 @@ import time
 from ..dmi import Dmi
 
 
+def find_duplicate_states(dmi_path):
+    dmi = Dmi.read_metadata(dmi_path)
+    duplicates = []
+    states = set()
+    for state in dmi.states:
+        # Movement states have the same name as their non-movement counterparts
+        if (state.name, state.movement) in states:
+            duplicates.append(state.name)
+        states.add((state.name, state.movement))
+    return duplicates
+
+
 if __name__ == "__main__":
     print("check_icon_dupenames started")
 
@@ -15,15 +28,12 @@ if __name__ == "__main__":
 
     findings = defaultdict(list)
 
-    for dmi_path in glob.glob("**/*.dmi", recursive=True):
-        dmi = Dmi.from_file(dmi_path)
-        states = set()
-        for state in dmi.states:
-            # Movement states have the same name as their non-movement counterparts
-            if (state.name, state.movement) in states:
-                findings[dmi_path].append(state.name)
-            states.add((state.name, state.movement))
-        count += 1
+    dmi_paths = glob.glob("**/*.dmi", recursive=True)
+    with ProcessPoolExecutor() as executor:
+        for dmi_path, duplicates in zip(dmi_paths, executor.map(find_duplicate_states, dmi_paths, chunksize=32)):
+            if duplicates:
+                findings[dmi_path] += duplicates
+            count += 1
 
     if findings:
         exit_code = 1
@@ -1,49 +1,77 @@
-
-#!/usr/bin/env python
-
-import os
-import sys
-import glob
-
-WINDOWS_NEWLINE = b'\r\n'
-
-FILES_TO_READ = []
-FILES_TO_READ.extend(glob.glob(r"**/*.dm", recursive=True))
-FILES_TO_READ.extend(glob.glob(r"**/*.dmm", recursive=True))
-FILES_TO_READ.extend(glob.glob(r"*.dme"))
-#for i in FILES_TO_READ:
-#	if os.path.isdir(i):
-#		FILES_TO_READ.remove(i)
-
-
-def _reader(filepath):
-	data = open(filepath, "rb")
-	return data
-
-
-def main():
-	filelist = []
-	foundfiles = False
-
-	for file in FILES_TO_READ:
-		data = _reader(file)
-		lines = data.readlines()
-		for line in lines:
-			if line.endswith(WINDOWS_NEWLINE):
-				filelist.append(file)
-				foundfiles = True
-				break
-		data.close()
-
-	if not foundfiles:
-		print("No CRLF files found.")
-		sys.exit(0)
-	else:
-		print("Found files with suspected CRLF type.")
-		for i in filelist:
-			print(i)
-		sys.exit(1)
-
-
-if __name__ == "__main__":
-	main()
+
+#!/usr/bin/env python
+
+import argparse
+import mmap
+import os
+import shutil
+import sys
+import glob
+from concurrent.futures import ThreadPoolExecutor
+
+WINDOWS_NEWLINE = b'\r\n'
+CHUNK_SIZE = 1024 * 1024
+
+FILES_TO_READ = []
+FILES_TO_READ.extend(glob.glob(r"**/*.dm", recursive=True))
+FILES_TO_READ.extend(glob.glob(r"**/*.dmm", recursive=True))
+FILES_TO_READ.extend(glob.glob(r"*.dme"))
+#for i in FILES_TO_READ:
+#	if os.path.isdir(i):
+#		FILES_TO_READ.remove(i)
+
+
+def has_crlf(filepath):
+	with open(filepath, "rb") as data:
+		try:
+			mapped = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+		except ValueError:
+			# Empty files can't be mapped
+			return False
+		with mapped:
+			return mapped.find(WINDOWS_NEWLINE) != -1
+
+
+def fix_crlf(filepath):
+	temp_path = filepath + ".crlf"
+	with open(filepath, "rb") as source, open(temp_path, "wb") as dest:
+		pending = b""
+		while chunk := source.read(CHUNK_SIZE):
+			chunk = pending + chunk
+			# Hold back a trailing \r in case its \n is in the next chunk
+			if chunk.endswith(b"\r"):
+				chunk, pending = chunk[:-1], b"\r"
+			else:
+				pending = b""
+			dest.write(chunk.replace(WINDOWS_NEWLINE, b"\n"))
+		dest.write(pending)
+	# keep the permissions, so scripts stay executable
+	shutil.copymode(filepath, temp_path)
+	os.replace(temp_path, filepath)
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--fix", action="store_true", help="convert any CRLF files found to LF")
+	args = parser.parse_args()
+
+	with ThreadPoolExecutor() as executor:
+		filelist = [file for file, found in zip(FILES_TO_READ, executor.map(has_crlf, FILES_TO_READ)) if found]
+
+	if not filelist:
+		print("No CRLF files found.")
+		sys.exit(0)
+	else:
+		print("Found files with suspected CRLF type.")
+		for i in filelist:
+			print(i)
+		if args.fix:
+			with ThreadPoolExecutor() as executor:
+				list(executor.map(fix_crlf, filelist))
+			print(f"Converted {len(filelist)} files to LF.")
+			sys.exit(0)
+		sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
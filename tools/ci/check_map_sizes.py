@@ -1,3 +1,4 @@
+import argparse
 import glob
 import os
 import sys
@@ -5,6 +6,9 @@ import subprocess
 import platform
 import json
 import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ..mapmerge2 import dmm
 
 parent_directory = "_maps/**/*.dmm"
 
@@ -51,7 +55,20 @@ def do_dmmtools_call(file):
 
     return return_obj
 
+def read_map_size(file, use_dmmtools=False):
+    if not use_dmmtools:
+        try:
+            size = dmm.DMM.size_from_file(file)
+            return {"x": size.x, "y": size.y, "z": size.z}
+        except ValueError as e:
+            print(f"{file}: {e}, falling back to dmm-tools")
+    return do_dmmtools_call(file)
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dmm-tools", action="store_true", help="read map sizes with the external dmm-tools binary")
+    args = parser.parse_args()
+
     start = time.time()
     # simple way to check if we're running on github actions, or on a local machine
     on_github = os.getenv("GITHUB_ACTIONS") == "true"
@@ -60,10 +77,12 @@ def main():
 
     map_count = 0
 
-    for map_file in glob.glob(parent_directory, recursive=True):
+    map_files = glob.glob(parent_directory, recursive=True)
+    with ProcessPoolExecutor() as executor:
+        map_sizes = list(executor.map(read_map_size, map_files, [args.dmm_tools] * len(map_files)))
+
+    for map_file, map_data in zip(map_files, map_sizes):
         map_count += 1
-        # Open the map in the nanomap dmm tools - it works
-        map_data = do_dmmtools_call(map_file)
 
         if map_data["x"] > MAX_X_SIZE or map_data["y"] > MAX_Y_SIZE or map_data["z"] > MAX_Z_SIZE:
             maps_greater_than_allowed.append((map_file, map_data))
@@ -1,11 +1,30 @@
+import argparse
+import bisect
 import fnmatch
-import glob
 import os
 import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import changed_files
 
 parent_directory = "code/**/*.dm"
 
+# This files/directories are expected to have "global" defines, so they must be exempt from this check.
+# Add directories as string here to automatically be exempt in case you have a non-complaint file name.
+excluded_files = [
+    #  Wildcard directories, all files are expected to be exempt.
+    "code/__DEFINES/*.dm",
+    "code/__HELPERS/*.dm",
+    "code/_globalvars/*.dm",
+    # TGS files come from another repository so lets not worry about them.
+    "code/modules/tgs/**/*.dm",
+]
+excluded_files_regex = re.compile("|".join(fnmatch.translate(os.path.normcase(pattern)) for pattern in excluded_files))
+
+define_regex = re.compile(r"^(\s+)?#define\s?([A-Z0-9_]+)\(?(.+)\)?", re.MULTILINE)
+undef_regex = re.compile(r"#undef\s([A-Za-z0-9_]*)")
+
 how_to_fix_message = "Please #undef the above defines or remake them as global defines in the code/__DEFINES directory."
 
 def green(text):
@@ -24,36 +43,43 @@ def post_error(define_name, file, github_error_style):
         directory, filename = os.path.split(file)
         print(f"- Failure: {red(define_name)} is defined locally in {directory}\{red(filename)} but not undefined locally!")
 
+def find_unhandled_defines(file_path):
+    """
+    Scan a file once, returning how many defines it has and the names of the
+    ones which are never undefined.
+    """
+    with open(file_path, encoding="utf8") as file:
+        file_contents = file.read()
+
+    defines = [define.group(2) for define in define_regex.finditer(file_contents)]
+    undefs = sorted({undef.group(1) for undef in undef_regex.finditer(file_contents)})
+
+    missing = []
+    for define_name in defines:
+        # An #undef of any name starting with the define's name counts, same as searching for "#undef\s<name>"
+        idx = bisect.bisect_left(undefs, define_name)
+        if idx == len(undefs) or not undefs[idx].startswith(define_name):
+            missing.append(define_name)
+
+    return len(defines), missing
+
 def main():
+    parser = argparse.ArgumentParser()
+    changed_files.add_arguments(parser)
+    args = parser.parse_args()
+
+    # Only a handful of files get scanned when checking changes, so the total define count means nothing
+    partial_run = bool(args.files or args.since)
 
     # simple way to check if we're running on github actions, or on a local machine
     on_github = os.getenv("GITHUB_ACTIONS") == "true"
 
-    # This files/directories are expected to have "global" defines, so they must be exempt from this check.
-    # Add directories as string here to automatically be exempt in case you have a non-complaint file name.
-    excluded_files = [
-        #  Wildcard directories, all files are expected to be exempt.
-        "code/__DEFINES/*.dm",
-        "code/__HELPERS/*.dm",
-        "code/_globalvars/*.dm",
-        # TGS files come from another repository so lets not worry about them.
-        "code/modules/tgs/**/*.dm",
-    ]
-
-    define_regex = re.compile(r"^(\s+)?#define\s?([A-Z0-9_]+)\(?(.+)\)?", re.MULTILINE)
-
     files_to_scan = []
 
     number_of_defines = 0
 
-    for code_file in glob.glob(parent_directory, recursive=True):
-        exempt_file = False
-        for exempt_directory in excluded_files:
-            if fnmatch.fnmatch(code_file, exempt_directory):
-                exempt_file = True
-                break
-
-        if exempt_file:
+    for code_file in changed_files.resolve(args, parent_directory):
+        if excluded_files_regex.match(os.path.normcase(code_file)):
             continue
 
         # If the "base path" of the file starts with an underscore, it's assumed to be an encapsulated file holding references to the other files in its folder and is exempt from the checks.
@@ -64,20 +90,16 @@ def main():
 
     located_error_tuples = []
 
-    for applicable_file in files_to_scan:
-        with open(applicable_file, encoding="utf8") as file:
-            file_contents = file.read()
-            for define in define_regex.finditer(file_contents):
-                number_of_defines += 1
-                define_name = define.group(2)
-                if not re.search("#undef\s" + define_name, file_contents):
-                    located_error_tuples.append((define_name, applicable_file))
+    with ProcessPoolExecutor() as executor:
+        for applicable_file, (file_defines, missing) in zip(files_to_scan, executor.map(find_unhandled_defines, files_to_scan, chunksize=64)):
+            number_of_defines += file_defines
+            located_error_tuples += [(define_name, applicable_file) for define_name in missing]
 
-    if number_of_defines == 0:
+    if number_of_defines == 0 and not partial_run:
         print(red("No defines found! This is likely an error."))
         sys.exit(1)
 
-    if number_of_defines <= 1000:
+    if number_of_defines <= 1000 and not partial_run:
         print(red(f"Only found {number_of_defines} defines! Something has likely gone wrong as the number of local defines should not be this low."))
         sys.exit(1)
 
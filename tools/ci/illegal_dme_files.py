@@ -5,12 +5,14 @@
 # but will cause actual issues on runtime. For example, dmm files are illegal
 # because they will mess with the map rotation system and z-levels in unexpected ways
 #
-# This is basically a slightly edited verison of unticked_files.py.
-# Look there for precise documentation on the methods used here.
-from pathlib import Path, PureWindowsPath
+# Include parsing is shared with unticked_files.py, see include_graph.py for
+# precise documentation on the methods used here.
+from pathlib import Path
 import argparse
 import sys
 
+from include_graph import IncludeGraph
+
 INCLUDED_FILES = [
     'paradise.dme'
 ]
@@ -20,19 +22,15 @@ ILLEGAL_FILES = ( # Use a tuple here
 )
 
 def get_illegal_files(root: Path):
+    graph = IncludeGraph.load(root)
     illegal_file_count = 0
     for includer in INCLUDED_FILES:
-        illegal_files = set()
-        with open(root / includer, 'r') as f:
-            # I've tried to optimize this, but this was the best I could get. Try placing the strips elsewhere if you dare
-            lines = [line for line in f.readlines() if line.rstrip('\r\n').strip('"').endswith(ILLEGAL_FILES)]
-            included = [line.replace('#include ', '').rstrip('\r\n').strip('"') for line in lines]
-            illegal_files.update([root / Path(includer).parent / Path(PureWindowsPath(i)) for i in included])
+        illegal_files = graph.illegal_includes(graph.root / includer, ILLEGAL_FILES)
 
         if len(illegal_files) >= 1:
             illegal_file_count += len(illegal_files)
             print(f'Found {len(illegal_files)} illegal files in {root / includer}:')
-            print('\n'.join(str(x) for x in sorted(illegal_files)), '\n')
+            print('\n'.join(str(root / x.relative_to(graph.root)) for x in sorted(illegal_files)), '\n')
 
     return illegal_file_count
 
@@ -0,0 +1,159 @@
+# Lexical model of which files are #included by the .dme and other includer
+# files, shared by unticked_files.py and illegal_dme_files.py. Has no semantic
+# knowledge, it just reads #include directives.
+#
+# Include paths are written Windows-style in the codebase, so they are munged
+# through PureWindowsPath before being resolved against the root. Otherwise on
+# POSIX a path like code\foo.dm would be treated as a file literally named
+# "code\foo.dm". All paths handed out are absolute Paths under the root.
+#
+# Parsing every includer is cheap but not free, so the parsed graph is cached
+# in tools/ci/.cache/ and reused until the mtime of any parsed includer changes.
+#
+# Usage:
+#   graph = IncludeGraph.load(Path("C:/Path/To/Paradise"))
+#   graph.is_ticked(Path("C:/Path/To/Paradise/code/foo.dm"))
+from collections import defaultdict, namedtuple
+from pathlib import Path, PureWindowsPath
+import json
+import os
+import posixpath
+
+INCLUDER_FILES = (
+    'paradise.dme',
+    'code/modules/tgs/includes.dm',
+    'code/tests/game_tests.dm',
+)
+
+CACHE_VERSION = 1
+CACHE_PATH = Path(__file__).resolve().parent / ".cache" / "include_graph.json"
+
+# `commented` is set for `// #include` lines, which are deliberately unticked
+# but still count as known to the includer.
+Include = namedtuple("Include", ["includer", "path", "commented"])
+
+
+def _parse_includer(root: Path, includer: str):
+    """
+    Read one includer, returning the relative posix paths it includes as
+    (path, commented) pairs.
+    """
+    includer_dir = PureWindowsPath(includer).parent
+    includes = []
+    with open(root / includer, 'r') as f:
+        for line in f:
+            if line.startswith('#include'):
+                commented = False
+            elif line.startswith('// #include'):
+                commented = True
+            else:
+                continue
+            included = line.replace('// ', '').replace('#include ', '').rstrip('\r\n').strip('"')
+            path = posixpath.normpath((includer_dir / PureWindowsPath(included)).as_posix())
+            includes.append((path, commented))
+    return includes
+
+
+class IncludeGraph:
+    def __init__(self, root: Path, includes: dict):
+        self.root = root
+        # includer -> list of (included, commented), all relative posix paths
+        self._includes = includes
+        self._included_by = defaultdict(list)
+        for includer, included in includes.items():
+            for path, commented in included:
+                self._included_by[path].append(Include(includer, path, commented))
+
+    @classmethod
+    def load(cls, root: Path, includers=INCLUDER_FILES, *, use_cache=True):
+        root = root.resolve()
+        key = f"{root.as_posix()}|{'|'.join(includers)}"
+
+        if use_cache:
+            cached = cls._load_cache(root, key)
+            if cached is not None:
+                return cls(root, cached)
+
+        includes = {}
+        pending = list(includers)
+        while pending:
+            includer = pending.pop(0)
+            if includer in includes:
+                continue
+            includes[includer] = _parse_includer(root, includer)
+            pending += [path for path, _ in includes[includer] if path.endswith('.dme')]
+
+        if use_cache:
+            cls._save_cache(root, key, includes)
+        return cls(root, includes)
+
+    @staticmethod
+    def _mtimes(root: Path, includers):
+        return {includer: os.stat(root / includer).st_mtime_ns for includer in includers}
+
+    @classmethod
+    def _load_cache(cls, root: Path, key: str):
+        try:
+            with open(CACHE_PATH, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        entry = data.get(key)
+        if data.get("version") != CACHE_VERSION or not entry:
+            return None
+        try:
+            if cls._mtimes(root, entry["mtimes"]) != entry["mtimes"]:
+                return None
+        except OSError:
+            return None
+        return {includer: [tuple(x) for x in included] for includer, included in entry["includes"].items()}
+
+    @classmethod
+    def _save_cache(cls, root: Path, key: str, includes: dict):
+        try:
+            with open(CACHE_PATH, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_VERSION:
+                data = {}
+        except (OSError, ValueError):
+            data = {}
+        data["version"] = CACHE_VERSION
+        data[key] = {"mtimes": cls._mtimes(root, includes), "includes": includes}
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(CACHE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+    def _relative(self, path: Path):
+        return path.resolve().relative_to(self.root).as_posix()
+
+    @property
+    def includers(self):
+        return [self.root / includer for includer in self._includes]
+
+    def includes_of(self, includer: Path):
+        """
+        Everything the given includer file includes, ticked or commented out.
+        """
+        relative = self._relative(includer)
+        return [Include(self.root / relative, self.root / path, commented) for path, commented in self._includes[relative]]
+
+    def included_by(self, path: Path):
+        """
+        Which includer files include the given file.
+        """
+        return [Include(self.root / i.includer, self.root / i.path, i.commented) for i in self._included_by.get(self._relative(path), ())]
+
+    def ticked_files(self):
+        """
+        Every file mentioned by an #include or // #include in any includer.
+        """
+        return {self.root / path for path in self._included_by}
+
+    def is_ticked(self, path: Path):
+        return self._relative(path) in self._included_by
+
+    def illegal_includes(self, includer: Path, extensions):
+        """
+        Files with any of the given extensions included by the given includer.
+        """
+        return {include.path for include in self.includes_of(includer) if include.path.name.endswith(tuple(extensions))}
@@ -1,12 +1,10 @@
-import glob
+import argparse
 import os
-import re
 import sys
 import time
-from collections import namedtuple, defaultdict
 
-Failure = namedtuple("Failure", ["filename", "lineno", "message"])
-Location = namedtuple("Location", ["filename", "lineno"])
+import changed_files
+import type_index
 
 RED = "\033[0;31m"
 GREEN = "\033[0;32m"
@@ -20,38 +18,35 @@ def print_error(message: str, filename: str, line_number: int):
         print(f"{filename}:{line_number}: {RED}{message}{NC}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    changed_files.add_arguments(parser)
+    args = parser.parse_args()
+
     print("no_duplicate_definitions started")
 
     exit_code = 0
     start = time.time()
 
-    dm_files = glob.glob("**/*.dm", recursive=True)
-
-    if len(sys.argv) > 1:
-        dm_files = sys.argv[1:]
-
-    all_failures = []
-
-    all_types = defaultdict(list)
-
-    for code_filepath in dm_files:
-        with open(code_filepath, encoding="UTF-8") as code:
-            filename = code_filepath.split(os.path.sep)[-1]
-
-            definition_matcher = re.compile(r'^(\/[\w][\w/]*?)(?: *\/[/*].*)?$')
-            for idx, line in enumerate(code):
-                if(rematch_result := re.search(definition_matcher, line)):
-                    typepath = rematch_result.group(1)
-                    if(not typepath):
-                        print_error("Failed to find a type, despite matching regex. If this happens, this CI is probably broken.", code_filepath, idx + 1)
-                        continue
-                    all_types[typepath].append(Location(code_filepath, idx + 1))
-
-    for key, value_list in all_types.items():
-        if len(value_list) > 1:
-            for location in value_list:
-                print_error(f"Found a duplicate definition of {key}.", location.filename, location.lineno)
-                exit_code = 1
+    if args.files:
+        index = type_index.TypeIndex(path=None)
+        index.update(args.files)
+        reported = None
+    else:
+        # Duplicates are a global property, so the whole index is brought up
+        # to date. That only re-reads files whose size or mtime changed, and
+        # stays correct whatever was checked out when the cache was written.
+        index = type_index.TypeIndex.load()
+        index.update()
+        index.save()
+        reported = set(map(type_index.normalize_path, changed_files.changed_since(args.since, "**/*.dm"))) if args.since else None
+
+    for key, value_list in index.duplicates().items():
+        # with --since, only report duplicates involving a changed file
+        if reported is not None and not any(location.filename in reported for location in value_list):
+            continue
+        for location in value_list:
+            print_error(f"Found a duplicate definition of {key}.", location.filename, location.lineno)
+            exit_code = 1
 
     end = time.time()
     print(f"no_duplicate_definitions tests completed in {end - start:.2f}s\n")
@@ -1,10 +1,12 @@
-import glob
+import argparse
 import os
-import re
 import sys
 import time
 from collections import namedtuple
 
+import changed_files
+import type_index
+
 Failure = namedtuple("Failure", ["filename", "lineno", "message"])
 
 RED = "\033[0;31m"
@@ -19,45 +21,43 @@ def print_error(message: str, filename: str, line_number: int):
         print(f"{filename}:{line_number}: {RED}{message}{NC}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    changed_files.add_arguments(parser)
+    args = parser.parse_args()
+
     print("restrict_file_types started")
 
     exit_code = 0
     start = time.time()
 
-    dm_files = glob.glob("**/*.dm", recursive=True)
+    dm_files = changed_files.resolve(args, "**/*.dm")
 
-    if len(sys.argv) > 1:
-        dm_files = sys.argv[1:]
+    if args.files or args.since:
+        # Only these files are checked, so index just them and leave the
+        # shared cache alone.
+        index = type_index.TypeIndex(path=None)
+        index.update(dm_files)
+    else:
+        index = type_index.TypeIndex.load()
+        index.update()
+        index.save()
 
     all_failures = []
 
     for code_filepath in dm_files:
-        with open(code_filepath, encoding="UTF-8") as code:
-            filename = code_filepath.split(os.path.sep)[-1]
-
-            restrict_regex = re.match(r"RESTRICT_TYPE\((.+)\)", code.read())
-            if(not restrict_regex):
-                continue
-
-            restrict_type_path = restrict_regex.group(1)
-
-            # Matches a definition into two groups:
-            # 1: The typepath or /proc (for global procs), required. First character is handled specially, to avoid picking up start-of-line comments.
-            # 2: The name of the proc, if any.
-            definition_matcher = re.compile(r'^(/[\w][\w/]*?)(?:/proc)?(?:/([\w]+)\(.*?)?(?: */[/*].*)?$')
-            code.seek(0)
-            for idx, line in enumerate(code):
-                if(rematch_result := re.search(definition_matcher, line)):
-                    if(restrict_type_path != rematch_result.group(1)):
-                        type_path = rematch_result.group(1)
-                        proc_name = rematch_result.group(2)
-                        if(type_path == "/proc"):
-                            all_failures += [Failure(code_filepath, idx + 1, f"'Global proc '/proc/{proc_name}' found in a file restricted to type '{restrict_type_path}'")]
-                        else:
-                            if(proc_name):
-                                all_failures += [Failure(code_filepath, idx + 1, f"'Proc '{type_path}/proc/{proc_name}' found in a file restricted to type '{restrict_type_path}'")]
-                            else:
-                                all_failures += [Failure(code_filepath, idx + 1, f"'Definition for different type '{type_path}' found in a file restricted to '{restrict_type_path}'")]
+        restrict_type_path = index.restrict_type_of(code_filepath)
+        if(not restrict_type_path):
+            continue
+
+        for type_path, proc_name, lineno in index.definitions_in(code_filepath):
+            if(restrict_type_path != type_path):
+                if(type_path == "/proc"):
+                    all_failures += [Failure(code_filepath, lineno, f"'Global proc '/proc/{proc_name}' found in a file restricted to type '{restrict_type_path}'")]
+                else:
+                    if(proc_name):
+                        all_failures += [Failure(code_filepath, lineno, f"'Proc '{type_path}/proc/{proc_name}' found in a file restricted to type '{restrict_type_path}'")]
+                    else:
+                        all_failures += [Failure(code_filepath, lineno, f"'Definition for different type '{type_path}' found in a file restricted to '{restrict_type_path}'")]
 
 
     if all_failures:
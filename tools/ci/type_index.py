@@ -0,0 +1,177 @@
+# Persistent index of where every typepath and proc is defined in the codebase.
+#
+# The index is stored in tools/ci/.cache/ and updated incrementally: a file is
+# only re-read when its size or mtime changed, and only re-parsed when its
+# content hash changed. Other tools can load it instead of rescanning every
+# .dm file themselves:
+#
+#   index = type_index.TypeIndex.load()
+#   index.update()
+#   index.save()
+#   for location in index.locations_of("/obj/item/foo"):
+#       ...
+import glob
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple, defaultdict
+
+INDEX_VERSION = 2
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "type_index.json")
+
+Location = namedtuple("Location", ["filename", "lineno"])
+Definition = namedtuple("Definition", ["type_path", "proc_name", "lineno"])
+
+# A bare type definition on its own line, optionally followed by a comment.
+TYPE_MATCHER = re.compile(r'^(\/[\w][\w/]*?)(?: *\/[/*].*)?$', re.MULTILINE)
+# Matches a definition into two groups:
+# 1: The typepath or /proc (for global procs), required. First character is handled specially, to avoid picking up start-of-line comments.
+# 2: The name of the proc, if any.
+DEFINITION_MATCHER = re.compile(r'^(/[\w][\w/]*?)(?:/proc)?(?:/([\w]+)\(.*?)?(?: */[/*].*)?$', re.MULTILINE)
+RESTRICT_TYPE_MATCHER = re.compile(r"RESTRICT_TYPE\((.+)\)")
+
+
+def normalize_path(filepath):
+    """
+    The key a file is indexed under: its path relative to the working
+    directory, with forward slashes, so that "./code/x.dm", "code/x.dm" and
+    "code\\x.dm" are all the same file.
+    """
+    return os.path.relpath(os.path.normpath(filepath)).replace(os.sep, "/")
+
+
+def _with_linenos(text, matches):
+    # matches come in order, so only count the newlines since the last one
+    lineno, last = 1, 0
+    for match in matches:
+        lineno += text.count("\n", last, match.start())
+        last = match.start()
+        yield match, lineno
+
+
+def parse_file(text):
+    """
+    Extract everything the index stores about a single file from its contents.
+    """
+    # Keep line numbering identical to iterating the file in text mode
+    text = text.replace("\r\n", "\n")
+    restrict_match = RESTRICT_TYPE_MATCHER.match(text)
+    # only restricted files have their definitions checked, and matching them
+    # is the slowest part of indexing
+    definitions = DEFINITION_MATCHER.finditer(text) if restrict_match else ()
+    return {
+        "types": [[match.group(1), lineno] for match, lineno in _with_linenos(text, TYPE_MATCHER.finditer(text))],
+        "definitions": [[match.group(1), match.group(2), lineno] for match, lineno in _with_linenos(text, definitions)],
+        "restrict_type": restrict_match.group(1) if restrict_match else None,
+    }
+
+
+class TypeIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.files = {}
+        self.dirty = False
+        self._by_type = None
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        """
+        Load the index from disk. A missing or outdated index loads as empty,
+        and will be fully rebuilt by the next update().
+        """
+        index = cls(path)
+        try:
+            with open(path, encoding="UTF-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get("version") == INDEX_VERSION:
+            index.files = data["files"]
+        return index
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="UTF-8") as f:
+            json.dump({"version": INDEX_VERSION, "files": self.files}, f)
+
+    def update(self, filepaths=None, *, prune=True):
+        """
+        Bring the index up to date with the given files (default: every .dm
+        file in the codebase). If `prune` is set, indexed files which no longer
+        exist are dropped. Returns the list of files which were re-parsed.
+        """
+        if filepaths is None:
+            filepaths = glob.glob("**/*.dm", recursive=True)
+
+        reparsed = []
+        for filepath in map(normalize_path, filepaths):
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                self.remove([filepath])
+                continue
+
+            entry = self.files.get(filepath)
+            if entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                continue
+
+            with open(filepath, "rb") as f:
+                contents = f.read()
+            digest = hashlib.sha1(contents).hexdigest()
+            if not entry or entry["hash"] != digest:
+                entry = {"hash": digest, **parse_file(contents.decode("UTF-8"))}
+                reparsed.append(filepath)
+            entry["mtime"] = stat.st_mtime_ns
+            entry["size"] = stat.st_size
+            self.files[filepath] = entry
+            self.dirty = True
+
+        if prune:
+            self.remove([filepath for filepath in self.files if not os.path.exists(filepath)])
+
+        if reparsed:
+            self._by_type = None
+        return reparsed
+
+    def remove(self, filepaths):
+        for filepath in filepaths:
+            if self.files.pop(normalize_path(filepath), None) is not None:
+                self.dirty = True
+                self._by_type = None
+
+    def _type_locations(self):
+        if self._by_type is None:
+            self._by_type = defaultdict(list)
+            for filepath, entry in self.files.items():
+                for type_path, lineno in entry["types"]:
+                    self._by_type[type_path].append(Location(filepath, lineno))
+        return self._by_type
+
+    def locations_of(self, type_path):
+        """
+        Where the given typepath is defined on its own line.
+        """
+        return list(self._type_locations().get(type_path, ()))
+
+    def duplicates(self):
+        """
+        Every typepath defined on its own line in more than one place.
+        """
+        return {type_path: locations for type_path, locations in self._type_locations().items() if len(locations) > 1}
+
+    def definitions_in(self, filepath):
+        """
+        Every type and proc definition in the given file, as Definitions.
+        These are only kept for files restricted by RESTRICT_TYPE().
+        """
+        return [Definition(*definition) for definition in self.files[normalize_path(filepath)]["definitions"]]
+
+    def restrict_type_of(self, filepath):
+        """
+        The type a file is restricted to by RESTRICT_TYPE(), or None.
+        """
+        return self.files[normalize_path(filepath)]["restrict_type"]
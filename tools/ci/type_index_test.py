@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import type_index
+
+
+def test_paths_are_normalized():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            with open("a.dm", "w", encoding="UTF-8") as f:
+                f.write("RESTRICT_TYPE(/obj/a)\n/obj/a\n")
+
+            index = type_index.TypeIndex(path=os.path.join(tmp, "type_index.json"))
+            index.update(["./a.dm"], prune=False)
+            index.update(["a.dm"], prune=False)
+            assert list(index.files) == ["a.dm"]
+            assert index.duplicates() == {}
+            assert index.restrict_type_of("./a.dm") == "/obj/a"
+            assert index.definitions_in("a.dm") == index.definitions_in("./a.dm")
+
+            index.remove(["./a.dm"])
+            assert index.files == {}
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    test_paths_are_normalized()
+    print("type_index_test: ok")
@@ -6,23 +6,13 @@
 #
 # Returns 0 if all existing files are considered ticked, 1 otherwise.
 
-# When running in POSIX environments, the include paths in the codebase need to
-# be munged into PureWindowsPaths before being spit back out. Otherwise, the
-# checker will attempt to find files named e.g. /workspace/code\\foo.dm, which
-# translates to the (completely legitimate) filename "code\foo.dm" in the
-# /workspace directory.
-#
-# For more information, see the discussion of pure paths in the pathlib
-# documentation.
-from pathlib import Path, PureWindowsPath
+# Include parsing (including the munging of Windows-style include paths on
+# POSIX) lives in include_graph.py, shared with illegal_dme_files.py.
+from pathlib import Path
 import argparse
 import sys
 
-INCLUDER_FILES = [
-    'paradise.dme',
-    'code/modules/tgs/includes.dm',
-    'code/tests/game_tests.dm',
-]
+from include_graph import IncludeGraph
 
 IGNORE_FILES = {
     # Included directly in the function /datum/tgs_api/v5#ApiVersion
@@ -35,20 +25,16 @@ IGNORE_FILES = {
 }
 
 def get_unticked_files(root:Path):
-    ticked_files = set()
-    for includer in INCLUDER_FILES:
-        with open(root / includer, 'r') as f:
-            lines = [line for line in f.readlines() if line.startswith('#include') or line.startswith('// #include')]
-            included = [line.replace('// ', '').replace('#include ', '').rstrip('\r\n').strip('"') for line in lines]
-            includer_path = "/".join(includer.split('/')[0:-1])
-            nested_dmes = [(includer_path + "/" if includer_path else "") + file for file in included if ".dme" in file]
-            print(f'Found {len(included)} includes and {len(nested_dmes)} nested .dme\'s in {root / includer}')
-            ticked_files.update([root / Path(includer).parent / Path(PureWindowsPath(i)) for i in included])
-            if nested_dmes: print(f"Additional include files: {', '.join(nested_dmes)}")
-            INCLUDER_FILES.extend([file.replace("\\", "/") for file in nested_dmes])
+    graph = IncludeGraph.load(root)
+    for includer in graph.includers:
+        included = graph.includes_of(includer)
+        nested_dmes = [str(i.path.relative_to(graph.root)) for i in included if i.path.suffix == '.dme']
+        print(f'Found {len(included)} includes and {len(nested_dmes)} nested .dme\'s in {root / includer.relative_to(graph.root)}')
+        if nested_dmes: print(f"Additional include files: {', '.join(nested_dmes)}")
 
-    all_dm_files = {f for f in root.glob('**/*.dm')}
-    return all_dm_files - ticked_files - {root / f for f in IGNORE_FILES}
+    all_dm_files = {f for f in graph.root.glob('**/*.dm')}
+    unticked_files = all_dm_files - graph.ticked_files() - {graph.root / f for f in IGNORE_FILES}
+    return {root / f.relative_to(graph.root) for f in unticked_files}
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -1,6 +1,12 @@
 # Tools for working with modern DreamMaker icon files (PNGs + metadata)
 
+import io
 import math
+import os
+from collections.abc import MutableSequence
+import struct
+import zlib
+import numpy
 from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 
@@ -35,6 +41,9 @@ DIR_NAMES = {
 }
 
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
 class Dmi:
     version = "4.0"
 
@@ -43,9 +52,20 @@ class Dmi:
         self.height = height
         self.states = []
 
+    @property
+    def states(self):
+        return self._states
+
+    @states.setter
+    def states(self, states):
+        self._states = StateList(states)
+        self._state_index = None
+
     @classmethod
     def from_file(cls, fname):
         image = Image.open(fname)
+        # frames are cut out lazily, so make sure the pixels are read while fname is still open
+        image.load()
         if image.mode != 'RGBA':
             image = image.convert('RGBA')
 
@@ -56,8 +76,62 @@ class Dmi:
             state.frame(image)
             return dmi
 
-        # read metadata
-        metadata = image.info['Description']
+        dmi = cls._from_metadata(image.info['Description'])
+
+        # mark out where each frame is, they're only cut out of the image on access
+        width, height = image.size
+        gridwidth = width // dmi.width
+        i = 0
+        for state in dmi.states:
+            boxes = []
+            for frame in range(state._nframes):
+                for dir in range(state.dirs):
+                    px = dmi.width * (i % gridwidth)
+                    py = dmi.height * (i // gridwidth)
+                    assert py + dmi.height <= height
+                    boxes.append((px, py, px + dmi.width, py + dmi.height))
+                    i += 1
+            state.frames = LazyFrames(image, boxes)
+            state._nframes = None
+
+        return dmi
+
+    @classmethod
+    def read_metadata(cls, fname):
+        """
+        Read only the size and state metadata of a DMI, straight from the PNG
+        chunks and without decoding any pixels. The states have no frames, but
+        their framecount is still correct.
+        """
+        width = height = None
+        with open(fname, 'rb') as f:
+            if f.read(8) != PNG_SIGNATURE:
+                raise ValueError(f"{fname} is not a PNG file")
+            while header := f.read(8):
+                length, chunk_type = struct.unpack('>I4s', header)
+                if chunk_type == b'IHDR':
+                    width, height = struct.unpack('>II', f.read(8))
+                    f.seek(length - 8 + 4, io.SEEK_CUR)
+                elif chunk_type in (b'zTXt', b'tEXt', b'iTXt'):
+                    data = f.read(length)
+                    f.seek(4, io.SEEK_CUR)
+                    keyword, text = _read_text_chunk(chunk_type, data)
+                    if keyword == 'Description':
+                        return cls._from_metadata(text)
+                elif chunk_type == b'IEND':
+                    break
+                else:
+                    # skip the chunk data and CRC, this is where the pixels are
+                    f.seek(length + 4, io.SEEK_CUR)
+
+        # no metadata = regular image file
+        dmi = Dmi(width, height)
+        state = dmi.state("")
+        state._nframes = 1
+        return dmi
+
+    @classmethod
+    def _from_metadata(cls, metadata):
         line_iter = iter(metadata.splitlines())
         assert next(line_iter) == "# BEGIN DMI"
         assert next(line_iter) == f"version = {cls.version}"
@@ -93,21 +167,6 @@ class Dmi:
             else:
                 raise NotImplementedError(key)
 
-        # cut image into frames
-        width, height = image.size
-        gridwidth = width // dmi.width
-        i = 0
-        for state in dmi.states:
-            for frame in range(state._nframes):
-                for dir in range(state.dirs):
-                    px = dmi.width * (i % gridwidth)
-                    py = dmi.height * (i // gridwidth)
-                    im = image.crop((px, py, px + dmi.width, py + dmi.height))
-                    assert im.size == (dmi.width, dmi.height)
-                    state.frames.append(im)
-                    i += 1
-            state._nframes = None
-
         return dmi
 
     def state(self, *args, **kwargs):
@@ -119,9 +178,25 @@ class Dmi:
     def default_state(self):
         return self.states[0]
 
-    def get_state(self, name):
+    def _build_state_index(self):
+        index = {}
         for state in self.states:
-            if state.name == name:
+            index.setdefault((state.name, state.movement), state)
+            index.setdefault((state.name, None), state)
+        self._state_index = (self.states.version, index)
+
+    def get_state(self, name, movement=None):
+        """
+        Find a state by name, and optionally by whether it is a movement state.
+        If several states match, the first one wins.
+        """
+        key = (name, movement)
+        for attempt in range(2):
+            # rebuild if the list of states was changed or states were renamed
+            if attempt or self._state_index is None or self._state_index[0] != self.states.version:
+                self._build_state_index()
+            state = self._state_index[1].get(key)
+            if state is not None and state.name == name and (movement is None or state.movement == movement):
                 return state
         raise KeyError(name)
 
@@ -152,28 +227,164 @@ class Dmi:
         comment += "# END DMI"
         return comment
 
-    def to_file(self, filename, *, palette=False):
+    def _assemble_sheet(self, columns=None):
+        W, H = self.width, self.height
+        frames = [frame for state in self.states for frame in state.frames]
+        sqrt = columns or math.ceil(math.sqrt(len(frames)))
+        rows = math.ceil(len(frames) / sqrt)
+
+        # (row, y, column, x, rgba) is laid out exactly like the final image
+        sheet = numpy.zeros((rows, H, sqrt, W, 4), dtype=numpy.uint8)
+        for i, frame in enumerate(frames):
+            if frame.mode != 'RGBA':
+                frame = frame.convert('RGBA')
+            sheet[i // sqrt, :, i % sqrt] = numpy.asarray(frame)
+        return sheet.reshape(rows * H, sqrt * W, 4)
+
+    def to_file(self, filename, *, palette=False, compress_level=None, columns=None):
+        """
+        Write the icon out as a PNG. With `palette`, the sheet is written as
+        a paletted image whenever it has few enough colours to do so without
+        losing anything, alpha included. `compress_level` is a zlib level from
+        0 to 9; by default the smallest possible output is searched for, which
+        is much slower. `columns` is how many frames wide the sheet is, by
+        default it is as close to square as possible.
+        """
         # assemble comment
         comment = self._assemble_comment()
 
         # assemble spritesheet
-        W, H = self.width, self.height
-        num_frames = sum(len(state.frames) for state in self.states)
-        sqrt = math.ceil(math.sqrt(num_frames))
-        output = Image.new('RGBA', (sqrt * W, math.ceil(num_frames / sqrt) * H))
-
-        i = 0
-        for state in self.states:
-            for frame in state.frames:
-                output.paste(frame, ((i % sqrt) * W, (i // sqrt) * H))
-                i += 1
+        pixels = self._assemble_sheet(columns)
+        output = None
+        save_options = {}
+        if palette:
+            output, save_options = _to_palette(pixels)
+        if output is None:
+            output = Image.fromarray(pixels, 'RGBA')
 
         # save
         pnginfo = PngInfo()
         pnginfo.add_text('Description', comment, zip=True)
-        if palette:
-            output = output.convert('P')
-        output.save(filename, 'png', optimize=True, pnginfo=pnginfo)
+        if compress_level is None:
+            save_options['optimize'] = True
+        else:
+            save_options['compress_level'] = compress_level
+        output.save(filename, 'png', pnginfo=pnginfo, **save_options)
+
+
+def _to_palette(pixels):
+    """
+    Convert RGBA pixels to a paletted image plus the PNG options it needs,
+    or (None, {}) if there are too many distinct colours to do so losslessly.
+    """
+    packed = pixels.view(numpy.uint32).reshape(pixels.shape[:2])
+    colours, indices = numpy.unique(packed, return_inverse=True)
+    if len(colours) > 256:
+        return None, {}
+
+    rgba = colours.view(numpy.uint8).reshape(-1, 4)
+    image = Image.fromarray(indices.reshape(packed.shape).astype(numpy.uint8), 'P')
+    image.putpalette(rgba[:, :3].tobytes())
+    options = {}
+    if (rgba[:, 3] != 255).any():
+        # written as the tRNS chunk, one alpha per palette entry
+        options['transparency'] = rgba[:, 3].tobytes()
+    return image, options
+
+
+class _ListWrapper(MutableSequence):
+    """
+    A mutable sequence over a private list, comparing equal to a list with
+    the same items.
+    """
+    def __init__(self, items=()):
+        self._items = list(items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._items[i]
+
+    def __setitem__(self, i, value):
+        self._items[i] = value
+
+    def __delitem__(self, i):
+        del self._items[i]
+
+    def insert(self, i, value):
+        self._items.insert(i, value)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, _ListWrapper)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def copy(self):
+        return list(self)
+
+    def sort(self, *, key=None, reverse=False):
+        self[:] = sorted(self, key=key, reverse=reverse)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r})"
+
+
+class StateList(_ListWrapper):
+    """
+    The states of a Dmi. Every change bumps `version`, which is what tells
+    Dmi.get_state() to rebuild its index.
+    """
+    def __init__(self, states=()):
+        super().__init__(states)
+        self.version = 0
+
+    def __setitem__(self, i, value):
+        super().__setitem__(i, value)
+        self.version += 1
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.version += 1
+
+    def insert(self, i, value):
+        super().insert(i, value)
+        self.version += 1
+
+
+class LazyFrames(_ListWrapper):
+    """
+    A list of frames which are only cut out of the shared spritesheet the
+    first time they are accessed, then cached. Every read goes through
+    __getitem__, so the placeholders for frames not yet cut out are never
+    seen outside.
+    """
+    class _Crop:
+        __slots__ = ['box']
+
+        def __init__(self, box):
+            self.box = box
+
+    def __init__(self, sheet, boxes):
+        super().__init__(self._Crop(box) for box in boxes)
+        self._sheet = sheet
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return super().__getitem__(i)
+        frame = self._items[i]
+        if isinstance(frame, self._Crop):
+            frame = self._sheet.crop(frame.box)
+            self._items[i] = frame
+        return frame
 
 
 class State:
@@ -218,6 +429,36 @@ class State:
         return self.frames[self._frame_index(*args, **kwargs)]
 
 
+def find_dmis(root='.'):
+    """
+    Every .dmi file under `root`, sorted, skipping .git.
+    """
+    fnames = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        for filename in filenames:
+            if filename.endswith('.dmi'):
+                fnames.append(os.path.normpath(os.path.join(dirpath, filename)))
+    return sorted(fnames)
+
+
+def _read_text_chunk(chunk_type, data):
+    keyword, _, rest = data.partition(b'\0')
+    if chunk_type == b'tEXt':
+        text = rest.decode('latin-1')
+    elif chunk_type == b'zTXt':
+        # compression method byte, then the zlib stream
+        text = zlib.decompress(rest[1:]).decode('latin-1')
+    else:
+        # iTXt: compression flag, method, language tag, translated keyword
+        compressed = rest[0]
+        language, _, rest = rest[2:].partition(b'\0')
+        translated, _, rest = rest.partition(b'\0')
+        text = (zlib.decompress(rest) if compressed else rest).decode('utf-8')
+    return keyword.decode('latin-1'), text
+
+
 def escape(text):
     text = text.replace('\\', '\\\\')
     text = text.replace('"', '\\"')
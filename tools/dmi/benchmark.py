@@ -0,0 +1,90 @@
+# Compare output size and write time of the ways Dmi.to_file can save an icon.
+#
+# Usage:
+#   tools/bootstrap/python -m dmi.benchmark [--count N] [--repeats N] [file.dmi ...]
+#
+# With no files given, the largest icons in the tree are used. Expect the
+# optimize modes to take a minute or more on the default set.
+import argparse
+import io
+import math
+import os
+import time
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from dmi import Dmi
+
+
+def legacy_to_file(dmi, filename):
+    # Dmi.to_file as it was before the sheet was assembled from a buffer
+    W, H = dmi.width, dmi.height
+    num_frames = sum(len(state.frames) for state in dmi.states)
+    sqrt = math.ceil(math.sqrt(num_frames))
+    output = Image.new('RGBA', (sqrt * W, math.ceil(num_frames / sqrt) * H))
+    i = 0
+    for state in dmi.states:
+        for frame in state.frames:
+            output.paste(frame, ((i % sqrt) * W, (i // sqrt) * H))
+            i += 1
+    pnginfo = PngInfo()
+    pnginfo.add_text('Description', dmi._assemble_comment(), zip=True)
+    output.save(filename, 'png', optimize=True, pnginfo=pnginfo)
+
+
+MODES = [
+    ("legacy", legacy_to_file),
+    ("optimize", lambda dmi, f: dmi.to_file(f)),
+    ("level 1", lambda dmi, f: dmi.to_file(f, compress_level=1)),
+    ("level 6", lambda dmi, f: dmi.to_file(f, compress_level=6)),
+    ("level 9", lambda dmi, f: dmi.to_file(f, compress_level=9)),
+    ("palette", lambda dmi, f: dmi.to_file(f, palette=True)),
+    ("palette level 1", lambda dmi, f: dmi.to_file(f, palette=True, compress_level=1)),
+]
+
+
+def _largest_dmis(count):
+    fnames = []
+    for dirpath, dirnames, filenames in os.walk('.'):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        fnames += [os.path.join(dirpath, f) for f in filenames if f.endswith('.dmi')]
+    return sorted(fnames, key=os.path.getsize, reverse=True)[:count]
+
+
+def _main():
+    parser = argparse.ArgumentParser(prog=f"python -m {__spec__.name}")
+    parser.add_argument("files", nargs="*", help="icons to write (default: the largest in the tree)")
+    parser.add_argument("--count", type=int, default=10, help="how many of the largest icons to use")
+    parser.add_argument("--repeats", type=int, default=1, help="take the best time of this many runs")
+    args = parser.parse_args()
+
+    fnames = args.files or _largest_dmis(args.count)
+    icons = []
+    for fname in fnames:
+        dmi = Dmi.from_file(fname)
+        # cut every frame out now so it isn't counted as write time
+        for state in dmi.states:
+            list(state.frames)
+        icons.append(dmi)
+
+    original = sum(os.path.getsize(fname) for fname in fnames)
+    print(f"{len(fnames)} icons, {original:,} bytes on disk")
+    print(f"{'mode':<16} {'bytes':>12} {'seconds':>9}")
+    for name, write in MODES:
+        size = 0
+        best = math.inf
+        for repeat in range(args.repeats):
+            size = 0
+            start = time.perf_counter()
+            for dmi in icons:
+                buffer = io.BytesIO()
+                write(dmi, buffer)
+                size += buffer.tell()
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:<16} {size:>12,} {best:>9.3f}")
+
+
+if __name__ == '__main__':
+    _main()
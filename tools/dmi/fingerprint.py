@@ -0,0 +1,201 @@
+# Persistent index of per-frame fingerprints for every .dmi in the tree, used
+# to find icon states which are duplicated across files.
+#
+# A frame's fingerprint is a hash of its exact RGBA pixels, with fully
+# transparent pixels normalised to (0, 0, 0, 0) first so that invisible
+# colour data doesn't hide a duplicate. A state's fingerprint covers its
+# frames plus everything else which affects how it is displayed.
+#
+# The index lives in tools/dmi/.cache/ and is keyed by the content hash of
+# each file, so only files which actually changed are decoded again.
+#
+# Usage:
+#   tools/bootstrap/python -m dmi.fingerprint [--rebuild] [--include-blank]
+import argparse
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+from dmi import Dmi, find_dmis
+
+INDEX_VERSION = 1
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "fingerprints.json")
+
+BLANK = "blank"
+
+
+def frame_fingerprint(frame):
+    pixels = numpy.array(frame.convert('RGBA'))
+    pixels[pixels[..., 3] == 0] = 0
+    if not pixels.any():
+        return BLANK
+    digest = hashlib.blake2b(f"{frame.size}".encode(), digest_size=16)
+    digest.update(pixels.tobytes())
+    return digest.hexdigest()
+
+
+def state_fingerprint(state, frames):
+    digest = hashlib.blake2b(digest_size=16)
+    properties = (state.dirs, state.framecount, state.delays, state.loop, state.rewind, state.movement, state.hotspots)
+    digest.update(repr(properties).encode())
+    for frame in frames:
+        digest.update(frame.encode())
+    return digest.hexdigest()
+
+
+def fingerprint_file(fname):
+    """
+    Decode a .dmi and fingerprint all of its states and frames.
+    """
+    dmi = Dmi.from_file(fname)
+    states = []
+    for state in dmi.states:
+        frames = [frame_fingerprint(frame) for frame in state.frames]
+        states.append({
+            "name": state.name,
+            "movement": state.movement,
+            "frames": frames,
+            "fingerprint": state_fingerprint(state, frames),
+        })
+    return {"width": dmi.width, "height": dmi.height, "states": states}
+
+
+def _hash_file(fname):
+    with open(fname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class FingerprintIndex:
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        # path -> {"mtime", "size", "hash"}
+        self.files = {}
+        # content hash -> fingerprint_file() result
+        self.contents = {}
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        """
+        Load the index from disk. A missing or outdated index loads as empty,
+        and will be fully rebuilt by the next update().
+        """
+        index = cls(path)
+        try:
+            with open(path, encoding="UTF-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get("version") == INDEX_VERSION:
+            index.files = data["files"]
+            index.contents = data["contents"]
+        return index
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="UTF-8") as f:
+            json.dump({"version": INDEX_VERSION, "files": self.files, "contents": self.contents}, f)
+
+    def update(self, fnames):
+        """
+        Bring the index up to date with the given files, dropping any others.
+        Returns the list of files which had to be decoded.
+        """
+        fnames = set(fnames)
+        for fname in list(self.files):
+            if fname not in fnames:
+                del self.files[fname]
+                self.dirty = True
+
+        stale = []
+        for fname in sorted(fnames):
+            stat = os.stat(fname)
+            entry = self.files.get(fname)
+            if not entry or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+                stale.append((fname, stat))
+
+        decoded = []
+        with ProcessPoolExecutor() as executor:
+            hashes = executor.map(_hash_file, [fname for fname, _ in stale], chunksize=32)
+            stale = [(fname, stat, digest) for (fname, stat), digest in zip(stale, hashes)]
+            # a copied or reverted file may already be known under its content hash
+            missing = {digest: fname for fname, _, digest in stale if digest not in self.contents}
+            results = executor.map(fingerprint_file, missing.values(), chunksize=8)
+            for digest, result in zip(missing, results):
+                self.contents[digest] = result
+            decoded = sorted(missing.values())
+
+        for fname, stat, digest in stale:
+            self.files[fname] = {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": digest}
+            self.dirty = True
+
+        referenced = {entry["hash"] for entry in self.files.values()}
+        for digest in list(self.contents):
+            if digest not in referenced:
+                del self.contents[digest]
+                self.dirty = True
+
+        return decoded
+
+    def duplicate_states(self, include_blank=False):
+        """
+        Every state fingerprint which appears more than once, mapped to the
+        sorted list of (file, state name, movement) it appears as.
+        """
+        found = defaultdict(list)
+        for fname, entry in self.files.items():
+            for state in self.contents[entry["hash"]]["states"]:
+                if not include_blank and all(frame == BLANK for frame in state["frames"]):
+                    continue
+                found[state["fingerprint"]].append((fname, state["name"], state["movement"]))
+        return {fingerprint: sorted(places, key=lambda place: (place[0], place[1] or "", place[2])) for fingerprint, places in found.items() if len(places) > 1}
+
+    def duplicate_frame_count(self):
+        """
+        How many non-blank frames are exact copies of a frame seen elsewhere.
+        """
+        seen = set()
+        duplicates = 0
+        for entry in self.files.values():
+            for state in self.contents[entry["hash"]]["states"]:
+                for frame in state["frames"]:
+                    if frame == BLANK:
+                        continue
+                    if frame in seen:
+                        duplicates += 1
+                    seen.add(frame)
+        return duplicates
+
+
+def _main():
+    parser = argparse.ArgumentParser(prog=f"python -m {__spec__.name}", description="Report icon states duplicated across .dmi files.")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the existing index and decode every file")
+    parser.add_argument("--include-blank", action="store_true", help="also report fully transparent states")
+    args = parser.parse_args()
+
+    index = FingerprintIndex() if args.rebuild else FingerprintIndex.load()
+    decoded = index.update(find_dmis())
+    index.save()
+
+    duplicates = index.duplicate_states(include_blank=args.include_blank)
+    groups = sorted(duplicates.values(), key=lambda places: (-len(places), places[0][0]))
+    for places in groups:
+        print(f"{len(places)} copies:")
+        for fname, name, movement in places:
+            print(f"    {fname}: {name!r}{' (movement)' if movement else ''}")
+
+    redundant = sum(len(places) - 1 for places in groups)
+    print(f"{len(index.files)} .dmi files indexed, {len(decoded)} decoded")
+    print(f"{len(groups)} duplicated states, {redundant} redundant copies")
+    print(f"{index.duplicate_frame_count()} duplicated frames")
+
+
+if __name__ == '__main__':
+    _main()
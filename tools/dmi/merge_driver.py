@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import sys
+import numpy
 import dmi
 from hooks.merge_frontend import MergeDriver
 
@@ -7,32 +8,32 @@ from hooks.merge_frontend import MergeDriver
 def images_equal(left, right):
     if left.size != right.size:
         return False
-    w, h = left.size
-    left_load, right_load = left.load(), right.load()
-    for y in range(0, h):
-        for x in range(0, w):
-            lpixel, rpixel = left_load[x, y], right_load[x, y]
-            # quietly ignore changes where both pixels are fully transparent
-            if lpixel != rpixel and (lpixel[3] != 0 or rpixel[3] != 0):
-                return False
-    return True
+    # frames read from a .dmi are already RGBA, so this is usually free
+    if left.mode != 'RGBA':
+        left = left.convert('RGBA')
+    if right.mode != 'RGBA':
+        right = right.convert('RGBA')
+    lpixels = numpy.asarray(left)
+    rpixels = numpy.asarray(right)
+    changed = (lpixels != rpixels).any(axis=2)
+    # quietly ignore changes where both pixels are fully transparent
+    changed &= (lpixels[..., 3] != 0) | (rpixels[..., 3] != 0)
+    return not changed.any()
 
 
 def states_equal(left, right):
-    result = True
-
     # basic properties
     for attr in ('loop', 'rewind', 'movement', 'dirs', 'delays', 'hotspots', 'framecount'):
         lval, rval = getattr(left, attr), getattr(right, attr)
         if lval != rval:
-            result = False
+            return False
 
     # frames
     for (left_frame, right_frame) in zip(left.frames, right.frames):
         if not images_equal(left_frame, right_frame):
-            result = False
+            return False
 
-    return result
+    return True
 
 
 def key_of(state):
@@ -163,7 +164,8 @@ class DmiDriver(MergeDriver):
         return not trouble, merge_result
 
     def to_file(self, outfile, merge_result):
-        merge_result.to_file(outfile)
+        # zlib's default level is within a few percent of optimize=True at a fraction of the time
+        merge_result.to_file(outfile, compress_level=6)
 
     def post_announce(self, success, merge_result):
         if not success:
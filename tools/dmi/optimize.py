@@ -0,0 +1,132 @@
+# Losslessly shrink .dmi files by re-encoding them.
+#
+# For each icon a few spritesheet layouts are tried, since lining frames up
+# so that similar pixels sit above each other helps PNG's filters. The best
+# layout is then written both with Pillow's optimizer and with plain zlib
+# level 9, paletted where that is lossless, and the smallest result wins.
+#
+# Frames are never dropped or reordered between states: BYOND relies on the
+# frame count of each state (flick() timing, directions), so the only freedom
+# is in how frames are laid out on the sheet. Every result is decoded again
+# and must match the original pixel for pixel, with identical metadata,
+# before it is allowed to replace the original file.
+#
+# Usage:
+#   tools/bootstrap/python -m dmi.optimize [--dry-run] [file.dmi ...]
+import argparse
+import io
+import math
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from dmi import Dmi, find_dmis
+
+# sheet layouts are compared at a quick compression level first
+TRIAL_LEVEL = 6
+
+
+def _layouts(dmi):
+    """
+    Candidate sheet widths, in frames.
+    """
+    num_frames = sum(len(state.frames) for state in dmi.states)
+    sqrt = math.ceil(math.sqrt(num_frames))
+    layouts = {sqrt}
+    # keep each direction of an animation in the same column
+    for dirs in {state.dirs for state in dmi.states if state.dirs > 1}:
+        layouts.add(max(dirs, round(sqrt / dirs) * dirs))
+    return sorted(layouts)
+
+
+def _encode(dmi, **kwargs):
+    buffer = io.BytesIO()
+    dmi.to_file(buffer, palette=True, **kwargs)
+    return buffer.getvalue()
+
+
+def _describe(dmi):
+    return [
+        (state.name, state.dirs, state.framecount, state.delays, state.loop, state.rewind, state.movement, state.hotspots)
+        for state in dmi.states
+    ]
+
+
+def _equivalent(original, data):
+    result = Dmi.from_file(io.BytesIO(data))
+    if (original.width, original.height) != (result.width, result.height):
+        return False
+    if _describe(original) != _describe(result):
+        return False
+    for state, new_state in zip(original.states, result.states):
+        for frame, new_frame in zip(state.frames, new_state.frames):
+            if frame.tobytes() != new_frame.tobytes():
+                return False
+    return True
+
+
+def optimize_file(fname, dry_run=False):
+    """
+    Re-encode a single .dmi. Returns (original size, new size, reason), where
+    reason is set if the file was left alone.
+    """
+    with open(fname, 'rb') as f:
+        original_data = f.read()
+    original_size = len(original_data)
+
+    with Image.open(io.BytesIO(original_data)) as image:
+        if 'Description' not in image.info:
+            return original_size, original_size, "not a DMI"
+
+    dmi = Dmi.from_file(io.BytesIO(original_data))
+    if not dmi.states:
+        return original_size, original_size, "no states"
+
+    columns = min(_layouts(dmi), key=lambda columns: len(_encode(dmi, compress_level=TRIAL_LEVEL, columns=columns)))
+    data = min((_encode(dmi, columns=columns), _encode(dmi, compress_level=9, columns=columns)), key=len)
+
+    if len(data) >= original_size:
+        return original_size, original_size, "already optimal"
+    if not _equivalent(dmi, data):
+        return original_size, original_size, "failed verification"
+
+    if not dry_run:
+        temp_path = fname + ".optimize"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        shutil.copymode(fname, temp_path)
+        os.replace(temp_path, fname)
+    return original_size, len(data), None
+
+
+def _main():
+    parser = argparse.ArgumentParser(prog=f"python -m {__spec__.name}", description="Losslessly shrink .dmi files.")
+    parser.add_argument("files", nargs="*", help="icons to optimize (default: every .dmi in the tree)")
+    parser.add_argument("--dry-run", action="store_true", help="report the savings without writing anything")
+    args = parser.parse_args()
+
+    fnames = args.files or find_dmis()
+    total_before = total_after = 0
+    failed = []
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(optimize_file, fnames, [args.dry_run] * len(fnames), chunksize=4)
+        for fname, (before, after, reason) in zip(fnames, results):
+            total_before += before
+            total_after += after
+            if reason == "failed verification":
+                failed.append(fname)
+            if reason is None:
+                print(f"{fname}: {before:,} -> {after:,} bytes, saved {before - after:,}")
+
+    saved = total_before - total_after
+    percent = 100 * saved / total_before if total_before else 0
+    print(f"{len(fnames)} icons, {total_before:,} -> {total_after:,} bytes, saved {saved:,} ({percent:.1f}%)")
+    for fname in failed:
+        print(f"{fname}: re-encoding did not round-trip, left unchanged")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    exit(_main())
@@ -1,36 +1,48 @@
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from dmi import *
 
 
-def _self_test():
+def _load(fullpath, full):
+    try:
+        if full:
+            Dmi.from_file(fullpath)
+        else:
+            Dmi.read_metadata(fullpath)
+    except Exception:
+        print('Failed on:', fullpath)
+        raise
+
+
+def _self_test(full=False):
     # test: can we load every DMI in the tree
-    count = 0
+    fullpaths = []
     for dirpath, dirnames, filenames in os.walk('.'):
         if '.git' in dirnames:
             dirnames.remove('.git')
         for filename in filenames:
             if filename.endswith('.dmi'):
-                fullpath = os.path.join(dirpath, filename)
-                try:
-                    Dmi.from_file(fullpath)
-                except Exception:
-                    print('Failed on:', fullpath)
-                    raise
-                count += 1
+                fullpaths.append(os.path.join(dirpath, filename))
+
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(_load, fullpaths, [full] * len(fullpaths), chunksize=32))
 
-    print(f"{os.path.relpath(__file__)}: successfully parsed {count} .dmi files")
+    what = "parsed" if full else "read metadata of"
+    print(f"{os.path.relpath(__file__)}: successfully {what} {len(fullpaths)} .dmi files")
 
 
 def _usage():
     print(f"Usage:")
-    print(f"    tools{os.sep}bootstrap{os.sep}python -m {__spec__.name}")
+    print(f"    tools{os.sep}bootstrap{os.sep}python -m {__spec__.name} [--full]")
     exit(1)
 
 
 def _main():
     if len(sys.argv) == 1:
         return _self_test()
+    if sys.argv[1:] == ['--full']:
+        return _self_test(full=True)
 
     return _usage()
 
@@ -0,0 +1,2 @@
+@call "%~dp0\..\bootstrap\python.bat" -m hooks.merge_frontend --posthoc-all %*
+@pause
@@ -1,5 +1,5 @@
 # merge_frontend.py
-import sys, io, os, pygit2, collections, typing
+import sys, io, os, pygit2, collections, contextlib, concurrent.futures, importlib, time, typing
 
 
 ENCODING = 'utf-8'
@@ -59,8 +59,18 @@ class MergeDriver:
         return _main(self, args or sys.argv[1:])
 
 
+# driver_id -> (module, class) of every merge driver --posthoc-all knows about.
+# Imported on demand, since the drivers themselves import this module.
+DRIVERS = {
+    'dmi': ('dmi.merge_driver', 'DmiDriver'),
+    'dmm': ('mapmerge2.merge_driver', 'DmmDriver'),
+}
+
+
 def _main(driver: MergeDriver, args: typing.List[str]):
-    if len(args) > 0 and args[0] == '--posthoc':
+    if len(args) > 0 and args[0] == '--posthoc-all':
+        return _posthoc_all_main(args[1:])
+    elif len(args) > 0 and args[0] == '--posthoc':
         return _posthoc_main(driver, args[1:])
     else:
         return _driver_main(driver, args)
@@ -94,67 +104,171 @@ def _driver_main(driver: MergeDriver, args: typing.List[str]):
         return 1
 
 
-def _posthoc_main(driver: MergeDriver, args: typing.List[str]):
+def _posthoc_merge(driver: MergeDriver, base: bytes, left: bytes, right: bytes):
     """
-    Apply merge driver logic to a repository which is already in a conflicted
-    state, running the driver on any conflicted files.
+    Run one merge in a worker process. Returns (success, merged bytes or None,
+    captured output, seconds taken) so that the parent can print everything
+    in order.
     """
+    start = time.perf_counter()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        success, merge_result = driver.merge(io.BytesIO(base), io.BytesIO(left), io.BytesIO(right))
+        merged = None
+        if merge_result:
+            io_output = io.BytesIO()
+            driver.to_file(_KeepOpen(io_output), merge_result)
+            merged = io_output.getvalue()
+        driver.post_announce(success, merge_result)
+    return success, merged, output.getvalue(), time.perf_counter() - start
+
+
+class _KeepOpen(io.BufferedIOBase):
+    """
+    Stops to_file() implementations which wrap the output in a TextIOWrapper
+    from closing our BytesIO when they are done with it.
+    """
+    def __init__(self, raw: typing.BinaryIO):
+        self._raw = raw
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._raw.write(data)
+
+
+def _open_conflicts():
     repo_dir = pygit2.discover_repository(os.getcwd())
     repo = pygit2.Repository(repo_dir)
-    conflicts = repo.index.conflicts
-    if not conflicts:
-        print("There are no unresolved conflicts.")
-        return 0
+    return repo, repo.index.conflicts
 
-    all_success = True
-    index_changed = False
-    any_attempted = False
+
+def _mergeable_conflicts(conflicts):
+    """
+    Yield the (base, left, right) index entries of conflicts a driver could
+    try to resolve.
+    """
     for base, left, right in list(conflicts):
         if not base or not left or not right:
             # (not left) or (not right): deleted in one branch, modified in the other.
             # (not base): added differently in both branches.
             # In either case, there's nothing we can do for now.
             continue
+        yield base, left, right
 
-        path = left.path
-        if not _applies_to(repo, driver, path):
-            # Skip the file if it's not the right extension.
-            continue
 
-        any_attempted = True
-        driver.pre_announce(path)
-        io_base = io.BytesIO(repo[base.id].data)
-        io_left = io.BytesIO(repo[left.id].data)
-        io_right = io.BytesIO(repo[right.id].data)
-        success, merge_result = driver.merge(io_base, io_left, io_right)
-        if merge_result:
-            # If we got anything, write it to the working directory.
-            with open(os.path.join(repo.workdir, path), 'wb') as io_output:
-                driver.to_file(io_output, merge_result)
-
-            if success:
-                # If we were successful, mark the conflict as resolved.
-                with open(os.path.join(repo.workdir, path), 'rb') as io_readback:
-                    contents = io_readback.read()
-                merged_id = repo.create_blob(contents)
-                repo.index.add(pygit2.IndexEntry(path, merged_id, left.mode))
-                del conflicts[path]
-                index_changed = True
-        if not success:
-            all_success = False
-        driver.post_announce(success, merge_result)
+def _posthoc_main(driver: MergeDriver, args: typing.List[str]):
+    """
+    Apply merge driver logic to a repository which is already in a conflicted
+    state, running the driver on any conflicted files.
+    """
+    repo, conflicts = _open_conflicts()
+    if not conflicts:
+        print("There are no unresolved conflicts.")
+        return 0
 
-    if index_changed:
-        repo.index.write()
+    jobs = []
+    for base, left, right in _mergeable_conflicts(conflicts):
+        if not _applies_to(repo, driver, left.path):
+            # Skip the file if it's not the right extension.
+            continue
+        jobs.append((driver, base, left, right))
 
-    if not any_attempted:
+    if not jobs:
         print("There are no unresolved", driver.driver_id, "conflicts.")
+        return 0
 
-    if not all_success:
+    results = _run_posthoc(repo, conflicts, jobs)
+    if not all(success for _, _, success, _ in results):
         # Not usually observed, but indicate the failure just in case.
         return 1
 
 
+def _posthoc_all_main(args: typing.List[str]):
+    """
+    Like --posthoc, but for every merge driver at once: each conflicted file
+    is handed to whichever driver its merge attribute names.
+    """
+    repo, conflicts = _open_conflicts()
+    if not conflicts:
+        print("There are no unresolved conflicts.")
+        return 0
+
+    # classify every conflicted path in one pass, then load only the drivers needed
+    candidates = list(_mergeable_conflicts(conflicts))
+    attrs = {left.path: repo.get_attr(left.path, 'merge') for _, left, _ in candidates}
+    drivers = {}
+    for driver_id in set(attrs.values()) & DRIVERS.keys():
+        module_name, class_name = DRIVERS[driver_id]
+        drivers[driver_id] = getattr(importlib.import_module(module_name), class_name)()
+
+    jobs = [(drivers[attrs[left.path]], base, left, right) for base, left, right in candidates if attrs[left.path] in drivers]
+    if not jobs:
+        print("There are no unresolved conflicts which a merge driver can handle.")
+        return 0
+
+    start = time.perf_counter()
+    results = _run_posthoc(repo, conflicts, jobs)
+    elapsed = time.perf_counter() - start
+
+    print()
+    print("Summary:")
+    for path, driver_id, success, seconds in results:
+        status = "resolved" if success else "MANUAL"
+        print(f"    {status:<8} {driver_id:<4} {seconds:6.2f}s  {path}")
+    handled = {path for path, _, _, _ in results}
+    for path in sorted(set(_remaining_paths(conflicts)) - handled):
+        print(f"    {'skipped':<8} {'':<4} {'':>7}  {path}")
+    resolved = sum(1 for _, _, success, _ in results if success)
+    print(f"{resolved} of {len(results)} files resolved in {elapsed:.2f}s")
+
+    if resolved != len(results):
+        return 1
+
+
+def _remaining_paths(conflicts):
+    for base, left, right in list(conflicts):
+        yield next(entry.path for entry in (left, right, base) if entry)
+
+
+def _run_posthoc(repo: pygit2.Repository, conflicts, jobs):
+    """
+    Merge each (driver, base, left, right) job in a process pool, writing the
+    results to the working directory and resolving the index conflict for
+    each success. Returns (path, driver_id, success, seconds) for each job.
+    """
+    results = []
+    index_changed = False
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        futures = [
+            executor.submit(_posthoc_merge, driver, repo[base.id].data, repo[left.id].data, repo[right.id].data)
+            for driver, base, left, right in jobs
+        ]
+        # report in a stable order, each as soon as it and everything before it is done
+        for (driver, _, left, _), future in zip(jobs, futures):
+            path = left.path
+            success, merged, output, seconds = future.result()
+            driver.pre_announce(path)
+            print(output, end='')
+            if merged is not None:
+                # If we got anything, write it to the working directory.
+                with open(os.path.join(repo.workdir, path), 'wb') as io_output:
+                    io_output.write(merged)
+
+                if success:
+                    # If we were successful, mark the conflict as resolved.
+                    merged_id = repo.create_blob(merged)
+                    repo.index.add(pygit2.IndexEntry(path, merged_id, left.mode))
+                    del conflicts[path]
+                    index_changed = True
+            results.append((path, driver.driver_id, success, seconds))
+
+    if index_changed:
+        repo.index.write()
+    return results
+
+
 def _applies_to(repo: pygit2.Repository, driver: MergeDriver, path: str):
     """
     Check if the current merge driver is a candidate to handle a given path.
@@ -162,3 +276,10 @@ def _applies_to(repo: pygit2.Repository, driver: MergeDriver, path: str):
     if not driver.driver_id:
         raise ValueError('Driver must have ID to perform post-hoc merge')
     return repo.get_attr(path, 'merge') == driver.driver_id
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] != ['--posthoc-all']:
+        print(f"usage: python -m {__spec__.name} --posthoc-all")
+        exit(1)
+    exit(_posthoc_all_main(sys.argv[2:]))
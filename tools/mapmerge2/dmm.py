@@ -1,6 +1,7 @@
 # Tools for working with DreamMaker maps
 
 import io
+import re
 import bidict
 import random
 from collections import namedtuple
@@ -29,6 +30,11 @@ class DMM:
     def from_bytes(bytes):
         return _parse(bytes.decode(ENCODING))
 
+    @staticmethod
+    def size_from_file(fname):
+        with open(fname, 'r', encoding=ENCODING) as f:
+            return parse_size(f.read())
+
     def to_file(self, fname, *, tgm = True):
         self._presave_checks()
         with open(fname, 'w', newline='\n', encoding=ENCODING) as f:
@@ -340,6 +346,41 @@ def save_dmm(dmm, output):
             output.write("\n")
         output.write("\"}\n")
 
+# ----------
+# Size-only parser
+
+FIRST_KEY_RE = re.compile(r'^"([a-zA-Z]+)" = \(', re.MULTILINE)
+COORD_BLOCK_RE = re.compile(r'^\((\d+),(\d+),(\d+)\) = \{"', re.MULTILINE)
+
+def parse_size(map_raw_text):
+    """
+    Work out a map's size from its coordinate blocks alone, without parsing
+    the dictionary or building the grid. Much faster than a full parse when
+    only the dimensions are needed.
+    """
+    key_match = FIRST_KEY_RE.search(map_raw_text)
+    if not key_match:
+        raise ValueError("dmm failed to parse, no dictionary keys found")
+    key_length = len(key_match.group(1))
+
+    maxx = maxy = maxz = 0
+    for match in COORD_BLOCK_RE.finditer(map_raw_text):
+        x, y, z = (int(n) for n in match.groups())
+        end = map_raw_text.find('"}', match.end())
+        if end == -1:
+            raise ValueError(f"dmm failed to parse, unterminated map string at ({x},{y},{z})")
+        rows = [row for row in map_raw_text[match.end():end].split("\n") if row.strip("\r")]
+        if not rows:
+            continue
+        width = max(len(row.rstrip("\r")) for row in rows) // key_length
+        maxx = max(maxx, x + width - 1)
+        maxy = max(maxy, y + len(rows) - 1)
+        maxz = max(maxz, z)
+
+    if not maxz:
+        raise ValueError("dmm failed to parse, no map blocks found")
+    return Coordinate(maxx, maxy, maxz)
+
 # ----------
 # Parser
 
@@ -1,4 +1,9 @@
 import mysql.connector, argparse, json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from batch_migration import Progress, count_rows, iter_batches, update_rows
 
 parser = argparse.ArgumentParser()
 parser.add_argument("address", help="MySQL server address (use localhost for the current computer)")
@@ -13,37 +18,36 @@ print("Connected to {}".format(args.database))
 
 paths_to_nuke = ["/datum/gear/accessory/scarf", "/datum/gear/accessory/scarf/red", "/datum/gear/accessory/scarf/green", "/datum/gear/accessory/scarf/darkblue", "/datum/gear/accessory/scarf/purple", "/datum/gear/accessory/scarf/yellow", "/datum/gear/accessory/scarf/orange", "/datum/gear/accessory/scarf/lightblue", "/datum/gear/accessory/scarf/white", "/datum/gear/accessory/scarf/black", "/datum/gear/accessory/scarf/zebra", "/datum/gear/accessory/scarf/christmas", "/datum/gear/accessory/scarf/stripedred", "/datum/gear/accessory/scarf/stripedgreen", "/datum/gear/accessory/scarf/stripedblue", "/datum/gear/accessory/tieblue", "/datum/gear/accessory/tiered", "/datum/gear/accessory/tieblack", "/datum/gear/accessory/tiehorrible", "/datum/gear/accessory/stethoscope", "/datum/gear/accessory/locket/silver", "/datum/gear/accessory/locket", "/datum/gear/accessory/necklace/long", "/datum/gear/accessory/necklace", "/datum/gear/suit/mantle", "/datum/gear/suit/old_scarf", "/datum/gear/suit/regal_shawl", "/datum/gear/suit/mantle/job", "/datum/gear/suit/mantle/job/captain", "/datum/gear/suit/mantle/job/ce", "/datum/gear/suit/mantle/job/cmo", "/datum/gear/suit/mantle/job/hos", "/datum/gear/suit/mantle/job/hop", "/datum/gear/suit/mantle/job/rd"]
 
-print("Loading data...")
-load_qry = "SELECT id, gear FROM characters WHERE gear IS NOT NULL AND gear != ''" # fucking allowing empty strings instead of nullables
-cursor.execute(load_qry)
-res = cursor.fetchall()
-
-to_replace = []
-
-for row in res:
-    row_id = row[0]
-    loadout = json.loads(row[1])
-
-    edited = False
-    for entry in paths_to_nuke:
-        if entry in loadout:
-            if isinstance(loadout, dict): # why the fuck are there dictionaries in the DB
-                del(loadout[entry])
-            else:
-                loadout.remove(entry)
-            edited = True
-
-    if edited:
-        to_replace.append([row_id, loadout])
-
-print("Loaded {} rows to update".format(len(to_replace)))
-
-update_qry = "UPDATE characters SET gear=%s WHERE id=%s"
-for entry in to_replace:
-    cursor.execute(update_qry, [json.dumps(entry[1]), entry[0]])
-
-print("Updates complete")
+print("Converting...")
+has_gear = "gear IS NOT NULL AND gear != ''" # fucking allowing empty strings instead of nullables
+progress = Progress("characters", count_rows(db, "characters", has_gear))
+updated = 0
+
+for res in iter_batches(db, "characters", ["id", "gear"], where=has_gear):
+    to_replace = []
+
+    for row in res:
+        row_id = row[0]
+        loadout = json.loads(row[1])
+
+        edited = False
+        for entry in paths_to_nuke:
+            if entry in loadout:
+                if isinstance(loadout, dict): # why the fuck are there dictionaries in the DB
+                    del(loadout[entry])
+                else:
+                    loadout.remove(entry)
+                edited = True
+
+        if edited:
+            to_replace.append((row_id, json.dumps(loadout)))
+
+    update_rows(cursor, "characters", "id", ["gear"], to_replace)
+    db.commit()
+    updated += len(to_replace)
+    progress.add(len(res))
+
+progress.finish()
+print("Updated {} rows".format(updated))
 cursor.close()
-print("Saving...")
-db.commit()
 print("Done!")
@@ -0,0 +1,417 @@
+# Shared helpers for the Python data migrations in SQL/updates and tools/pr_sql.
+#
+# Instead of fetchall() on a whole table and one execute() per changed row,
+# tables are read in fixed-size batches in primary key order, and each batch
+# is written back with a single multi-row statement and committed before the
+# next one is read. Every batch query is a range scan on the primary key, so
+# the connection is free to write in between and memory use stays flat no
+# matter how big the table is.
+#
+# Long migrations can also save a checkpoint with every batch, so that if
+# they are interrupted, running them again carries on where they stopped.
+# run_pipeline() overlaps reading, processing and writing those batches, and
+# migrate_typepaths() uses it to apply typepath renames to several tables at
+# once.
+#
+# The scripts using this are run directly, so they import it by path:
+#
+#   sys.path.append(str(Path(__file__).resolve().parents[1]))
+#   from batch_migration import ...
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import json
+import queue
+import re
+import threading
+import time
+
+BATCH_SIZE = 1000
+PROGRESS_INTERVAL = 5  # seconds
+CHECKPOINT_TABLE = "migration_checkpoint"
+PIPELINE_DEPTH = 4  # batches read ahead of the writer, per table
+
+
+def log(msg):
+    print(f"[{datetime.utcnow()}] {msg}", flush=True)
+
+
+class Progress:
+    """
+    Counts processed rows and logs the count and rate every few seconds.
+    """
+
+    def __init__(self, label, total=None):
+        self.label = label
+        self.total = total
+        self.rows = 0
+        self.start = self.last_report = time.monotonic()
+
+    def add(self, rows):
+        self.rows += rows
+        now = time.monotonic()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self.start
+        rate = self.rows / elapsed if elapsed > 0 else 0
+        of_total = f"/{self.total:,}" if self.total is not None else ""
+        log(f"{self.label}: {self.rows:,}{of_total} rows, {rate:,.0f} rows/sec")
+
+    def finish(self):
+        self.report()
+
+
+def count_rows(db, table, where=None, params=()):
+    cursor = db.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {table}" + (f" WHERE {where}" if where else ""), params)
+    count = cursor.fetchone()[0]
+    cursor.close()
+    return count
+
+
+def iter_batches(db, table, columns, key="id", where=None, params=(), batch_size=BATCH_SIZE, after=None):
+    """
+    Yield the rows of `table` as lists of up to `batch_size` tuples of
+    `columns`, ordered by `key`. `key` must be unique, and either one of
+    `columns` or the first column of the table when selecting ["*"]. Only
+    rows matching the optional `where` clause are returned, and only those
+    with a key greater than `after` if it is given.
+    """
+    key_index = columns.index(key) if key in columns else 0
+    cursor = db.cursor()
+    while True:
+        conditions = [f"({where})"] if where else []
+        query_params = list(params)
+        if after is not None:
+            conditions.append(f"{key} > %s")
+            query_params.append(after)
+        cursor.execute(
+            f"SELECT {', '.join(columns)} FROM {table}"
+            + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+            + f" ORDER BY {key} LIMIT {int(batch_size)}",
+            query_params,
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        yield rows
+        if len(rows) < batch_size:
+            break
+        after = rows[-1][key_index]
+    cursor.close()
+
+
+def insert_rows(cursor, table, columns, rows, update=None, ignore=False):
+    """
+    Insert `rows` with one multi-row INSERT. If `update` is a list of
+    columns, rows whose key already exists have those columns overwritten
+    instead; an empty list leaves existing rows untouched. `ignore` makes it
+    an INSERT IGNORE. Returns the affected row count.
+    """
+    if not rows:
+        return 0
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    query = (
+        f"INSERT {'IGNORE ' if ignore else ''}INTO {table} ({', '.join(columns)}) VALUES "
+        + ", ".join([placeholders] * len(rows))
+    )
+    if update is not None:
+        assignments = [f"{column} = VALUES({column})" for column in update] or [f"{columns[0]} = {columns[0]}"]
+        query += " ON DUPLICATE KEY UPDATE " + ", ".join(assignments)
+    cursor.execute(query, [value for row in rows for value in row])
+    return cursor.rowcount
+
+
+def update_rows(cursor, table, key, columns, rows):
+    """
+    Set `columns` on existing rows with one UPDATE. Each row is a tuple of
+    the key followed by the new values, in the order of `columns`. Returns
+    the affected row count.
+    """
+    if not rows:
+        return 0
+    cases = " ".join(["WHEN %s THEN %s"] * len(rows))
+    assignments = ", ".join(f"{column} = CASE {key} {cases} END" for column in columns)
+    params = [value for i in range(len(columns)) for row in rows for value in (row[0], row[i + 1])]
+    params += [row[0] for row in rows]
+    cursor.execute(
+        f"UPDATE {table} SET {assignments} WHERE {key} IN ({', '.join(['%s'] * len(rows))})",
+        params,
+    )
+    return cursor.rowcount
+
+
+class Checkpoints:
+    """
+    Where each step of a migration got to, kept in a table in the database
+    being migrated. Saving a checkpoint is part of the same transaction as
+    the batch it follows, so on InnoDB tables they commit or roll back
+    together. Writes to MyISAM tables can't be rolled back, so those must
+    either be safe to repeat or be undone by the script when it resumes.
+    """
+
+    def __init__(self, db, migration):
+        self.db = db
+        self.migration = migration
+        cursor = db.cursor()
+        cursor.execute(
+            f"""CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                migration VARCHAR(64) NOT NULL,
+                step VARCHAR(64) NOT NULL,
+                state LONGTEXT NOT NULL,
+                updated DATETIME NOT NULL,
+                PRIMARY KEY (migration, step)
+            )"""
+        )
+        cursor.execute(f"SELECT step, state FROM {CHECKPOINT_TABLE} WHERE migration = %s", (migration,))
+        self.states = {step: json.loads(state) for step, state in cursor.fetchall()}
+        cursor.close()
+        db.commit()
+
+    def state(self, step):
+        """
+        The saved state of `step`, as a dict which is empty if it hasn't
+        started. Scripts can keep their own values in it, which are saved
+        along with each batch.
+        """
+        return self.states.setdefault(step, {})
+
+    def save(self, cursor, step):
+        state = json.dumps(self.state(step))
+        insert_rows(cursor, CHECKPOINT_TABLE, ["migration", "step", "state", "updated"], [(self.migration, step, state, datetime.utcnow())], update=["state", "updated"])
+
+    def batches(self, step, table, columns, key="id", where=None, params=(), batch_size=BATCH_SIZE):
+        """
+        Like iter_batches(), but carrying on after the last batch saved for
+        `step`, and yielding nothing at all once it has finished. Any writes
+        for a batch must be made before asking for the next one, as that
+        saves the checkpoint and commits.
+        """
+        state = self.state(step)
+        if state.get("done"):
+            log(f"{step}: already done, skipping")
+            return
+        if "last" in state:
+            log(f"{step}: resuming after {key} {state['last']}")
+        key_index = columns.index(key) if key in columns else 0
+        cursor = self.db.cursor()
+        for rows in iter_batches(self.db, table, columns, key, where, params, batch_size, state.get("last")):
+            yield rows
+            state["last"] = rows[-1][key_index]
+            self.save(cursor, step)
+            self.db.commit()
+        state["done"] = True
+        self.save(cursor, step)
+        self.db.commit()
+        cursor.close()
+
+    def reset(self):
+        """
+        Forget all progress, so the next run starts from the beginning.
+        """
+        cursor = self.db.cursor()
+        cursor.execute(f"DELETE FROM {CHECKPOINT_TABLE} WHERE migration = %s", (self.migration,))
+        self.db.commit()
+        cursor.close()
+        self.states = {}
+
+    def finish(self):
+        """
+        Called once the whole migration is done. Removes its checkpoints, and
+        the checkpoint table too if nothing else is using it.
+        """
+        self.reset()
+        cursor = self.db.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {CHECKPOINT_TABLE}")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f"DROP TABLE {CHECKPOINT_TABLE}")
+        cursor.close()
+
+
+def run_pipeline(connect, checkpoints, step, table, columns, transform, write, pool, key="id", where=None, params=(), batch_size=BATCH_SIZE):
+    """
+    Run one step of a migration as a pipeline, so reading, processing and
+    writing overlap. A thread reads batches on its own connection from
+    `connect()` and submits `transform(rows)` to the executor `pool` for
+    each. The results are passed in order to `write(cursor, result)` on a
+    second connection, and committed along with the step's checkpoint. A
+    process pool needs `transform` to be a module level function.
+    """
+    state = checkpoints.state(step)
+    if state.get("done"):
+        log(f"{step}: already done, skipping")
+        return
+    if "last" in state:
+        log(f"{step}: resuming after {key} {state['last']}")
+
+    key_index = columns.index(key) if key in columns else 0
+    pending = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stopping = threading.Event()
+    reader_db = connect()
+    try:
+        writer_db = connect()
+        try:
+            progress = Progress(step, count_rows(reader_db, table, where, params))
+
+            def read():
+                try:
+                    for rows in iter_batches(reader_db, table, columns, key, where, params, batch_size, state.get("last")):
+                        if stopping.is_set():
+                            break
+                        pending.put((rows[-1][key_index], len(rows), pool.submit(transform, rows)))
+                    pending.put(None)
+                except Exception as e:
+                    pending.put(e)
+
+            reader = threading.Thread(target=read, name=f"{step} reader", daemon=True)
+            reader.start()
+            cursor = writer_db.cursor()
+            try:
+                while True:
+                    item = pending.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    last, count, future = item
+                    write(cursor, future.result())
+                    state["last"] = last
+                    checkpoints.save(cursor, step)
+                    writer_db.commit()
+                    progress.add(count)
+            finally:
+                # let the reader finish if the writer failed, before its connection is closed
+                stopping.set()
+                while reader.is_alive():
+                    try:
+                        pending.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+            state["done"] = True
+            checkpoints.save(cursor, step)
+            writer_db.commit()
+            cursor.close()
+            progress.finish()
+        finally:
+            writer_db.close()
+    finally:
+        reader_db.close()
+
+
+def replace_one_by_one(text, renames):
+    # how REPLACE() used to be run for each matching rename in turn, with
+    # the renames sorted longest first
+    row_replacements = [rename for rename in renames if rename["original"] in text]
+    for replacement in row_replacements:
+        text = text.replace(
+            replacement["original"],
+            replacement.get("override", replacement["replace"]),
+        )
+    return text
+
+
+def longest_match_pattern(words):
+    # a regex for a prefix tree of the words: only one branch can match the
+    # next character at each step, and a word ending is optional while a
+    # longer word could continue, so the longest word at a position matches
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{pattern})?" if "" in node else pattern
+
+    return re.compile(build(trie))
+
+
+def compile_renames(renames):
+    """
+    Build a function which applies every rename to a string in one pass.
+    A single regex matches the longest original at each position. Each
+    match is replaced with what replacing the renames one by one turned that
+    original into, as a shorter rename can apply to a longer one's output,
+    so the results are the same as they were with REPLACE().
+    """
+    outputs = {rename["original"]: replace_one_by_one(rename["original"], renames) for rename in renames}
+    pattern = longest_match_pattern(outputs)
+    return lambda text: pattern.sub(lambda match: outputs[match.group(0)], text)
+
+
+# the rewrite function of each worker process, set up by _init_rename_worker()
+_worker_rewrite = None
+
+
+def _init_rename_worker(renames):
+    global _worker_rewrite
+    _worker_rewrite = compile_renames(renames)
+
+
+def _rename_rows(rows):
+    updates = []
+    for row_id, text in rows:
+        if not text:
+            continue
+        new_text = _worker_rewrite(text)
+        if new_text != text:
+            updates.append((row_id, new_text))
+    return updates
+
+
+def migrate_table(connect, checkpoints, pool, table, column):
+    """
+    Apply the renames of the worker processes in `pool` to `column` of
+    every row in `table`, as one step of `checkpoints`.
+    """
+    log(f"{table}: processing rows...")
+    state = checkpoints.state(table)
+
+    def write(cursor, updates):
+        # rewriting already converted text changes nothing, so if a batch
+        # was written but its checkpoint wasn't, doing it again is harmless
+        update_rows(cursor, table, "id", [column], updates)
+        state["updated"] = state.get("updated", 0) + len(updates)
+
+    run_pipeline(connect, checkpoints, table, table, ["id", column], _rename_rows, write, pool)
+    log(f"{table}: updated {state.get('updated', 0)} rows")
+
+
+def migrate_typepaths(connect, migration, renames, tables, restart=False, jobs=None):
+    """
+    Rename typepaths stored in the database. `renames` is the list of
+    {"original", "replace", optional "override"} remaps, and `tables` a
+    list of (table, column) to rewrite. Every table is read and written on
+    its own connections at the same time, with the rewriting shared between
+    `jobs` processes. An interrupted run carries on from the last batch it
+    committed, unless `restart` is set.
+    """
+    db = connect()
+    try:
+        checkpoints = Checkpoints(db, migration)
+        if restart:
+            checkpoints.reset()
+
+        # want these ordered by length from longest to shortest so shorter replacements
+        # don't replace pieces of larger replacements
+        renames = sorted(renames, key=lambda x: len(x["original"]), reverse=True)
+
+        with ProcessPoolExecutor(jobs, initializer=_init_rename_worker, initargs=(renames,)) as pool:
+            with ThreadPoolExecutor(len(tables)) as executor:
+                futures = [
+                    executor.submit(migrate_table, connect, checkpoints, pool, table, column)
+                    for table, column in tables
+                ]
+                for future in futures:
+                    future.result()
+        checkpoints.finish()
+    finally:
+        db.close()
@@ -0,0 +1,141 @@
+import argparse
+import csv
+import json
+import sys
+import numpy
+from utracy import *
+
+# Durations are histogrammed on a log scale with this many buckets per
+# doubling, so percentiles are accurate to within about 1%.
+HistogramResolution = 64
+HistogramBuckets = 64 * HistogramResolution + 1
+
+class ZoneStats:
+	"""
+	Per-srcloc zone statistics, accumulated from chunks of file events.
+	"""
+	def __init__(self, srcloc_count):
+		self.count = numpy.zeros(srcloc_count, numpy.int64)
+		self.inclusive = numpy.zeros(srcloc_count, numpy.int64)
+		self.exclusive = numpy.zeros(srcloc_count, numpy.int64)
+		self.histogram = {}
+		self.frames = 0
+		self.first_timestamp = None
+		self.last_timestamp = None
+		self._pairer = ZonePairer()
+
+	def add(self, events):
+		types = events["type"]
+		frame_marks = types == FileEventFrameMark
+		self.frames += int(numpy.count_nonzero(frame_marks))
+
+		timed = frame_marks | (types == FileEventZoneBegin) | (types == FileEventZoneEnd)
+		if numpy.any(timed):
+			timestamps = events["timestamp"][timed]
+			if self.first_timestamp is None:
+				self.first_timestamp = int(timestamps[0])
+			self.last_timestamp = int(timestamps[-1])
+
+		zones = self._pairer.add(events)
+		srclocs = zones["srcloc"]
+		durations = zones["end_timestamp"] - zones["begin_timestamp"]
+		numpy.add.at(self.count, srclocs, 1)
+		numpy.add.at(self.inclusive, srclocs, durations)
+		numpy.add.at(self.exclusive, srclocs, durations - zones["children"])
+
+		buckets = numpy.zeros(len(durations), numpy.int64)
+		positive = durations > 0
+		buckets[positive] = 1 + numpy.floor(numpy.log2(durations[positive]) * HistogramResolution).astype(numpy.int64)
+		pairs, counts = numpy.unique(srclocs * HistogramBuckets + buckets, return_counts=True)
+		for pair, count in zip(pairs.tolist(), counts.tolist()):
+			key = divmod(pair, HistogramBuckets)
+			self.histogram[key] = self.histogram.get(key, 0) + count
+
+	def percentiles(self, quantiles):
+		"""
+		Approximate duration percentiles of every srcloc, as a
+		(srcloc_count, len(quantiles)) array of raw timestamp units.
+		"""
+		result = numpy.zeros((len(self.count), len(quantiles)))
+		by_srcloc = {}
+		for (srcloc, bucket), count in self.histogram.items():
+			by_srcloc.setdefault(srcloc, []).append((bucket, count))
+		for srcloc, buckets in by_srcloc.items():
+			buckets.sort()
+			bucket_ids = numpy.array([bucket for bucket, _ in buckets])
+			cumulative = numpy.cumsum([count for _, count in buckets])
+			wanted = numpy.searchsorted(cumulative, numpy.array(quantiles) * cumulative[-1])
+			chosen = bucket_ids[numpy.minimum(wanted, len(bucket_ids) - 1)]
+			# the middle of each bucket, bucket 0 holds zero length zones
+			result[srcloc] = numpy.where(chosen > 0, numpy.exp2((chosen - 0.5) / HistogramResolution), 0)
+		return result
+
+def analyze(fname):
+	"""
+	Read a whole capture, returning (header, srclocs, ZoneStats).
+	"""
+	with CaptureReader(fname) as reader:
+		stats = ZoneStats(len(reader.srclocs))
+		for events in reader.chunks():
+			stats.add(events)
+		events = None
+		return reader.header, reader.srclocs, stats
+
+def decode(string):
+	return string.decode("utf-8", "replace") if string is not None else ""
+
+def summarize(header, srclocs, stats):
+	"""
+	One row per srcloc which was seen at least once, times in milliseconds.
+	"""
+	to_ms = header.multiplier / 1e6
+	percentiles = stats.percentiles((0.5, 0.95, 0.99))
+	rows = []
+	for i in numpy.flatnonzero(stats.count):
+		name, function, file, line, _ = srclocs[i]
+		count = int(stats.count[i])
+		rows.append({
+			"name": decode(name),
+			"function": decode(function),
+			"file": decode(file),
+			"line": line,
+			"count": count,
+			"inclusive_ms": round(stats.inclusive[i] * to_ms, 6),
+			"exclusive_ms": round(stats.exclusive[i] * to_ms, 6),
+			"mean_ms": round(stats.inclusive[i] * to_ms / count, 6),
+			"p50_ms": round(percentiles[i][0] * to_ms, 6),
+			"p95_ms": round(percentiles[i][1] * to_ms, 6),
+			"p99_ms": round(percentiles[i][2] * to_ms, 6),
+		})
+	return rows
+
+SortColumns = ("inclusive_ms", "exclusive_ms", "count", "mean_ms", "p99_ms")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Summarise the zones in a .utracy capture without the Tracy GUI.")
+	parser.add_argument("file")
+	parser.add_argument("--format", choices=("csv", "json"), default="csv")
+	parser.add_argument("--output", "-o", type=argparse.FileType("w", encoding="utf-8"), default=sys.stdout)
+	parser.add_argument("--sort", choices=SortColumns, default="exclusive_ms")
+	parser.add_argument("--top", type=int, help="only output the first N procs")
+	args = parser.parse_args()
+
+	try:
+		header, srclocs, stats = analyze(args.file)
+	except ValueError as e:
+		print(e)
+		sys.exit(1)
+
+	rows = sorted(summarize(header, srclocs, stats), key=lambda row: row[args.sort], reverse=True)[:args.top]
+	if args.format == "json":
+		json.dump({
+			"program": decode(header.program_name),
+			"frames": stats.frames,
+			"duration_ms": ((stats.last_timestamp or 0) - (stats.first_timestamp or 0)) * header.multiplier / 1e6,
+			"procs": rows,
+		}, args.output, indent="\t")
+		args.output.write("\n")
+	else:
+		writer = csv.DictWriter(args.output, fieldnames=list(rows[0]) if rows else ["name"], lineterminator="\n")
+		writer.writeheader()
+		writer.writerows(rows)
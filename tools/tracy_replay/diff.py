@@ -0,0 +1,135 @@
+import argparse
+import csv
+import json
+import sys
+import numpy
+from analyze import analyze, decode
+
+def aggregate(fname, metric):
+	"""
+	Per-proc totals of a capture, keyed by (name, function, file, line) so
+	they can be matched up between captures with different srcloc tables.
+	Returns (frames, {key: [count, total ms]}).
+	"""
+	header, srclocs, stats = analyze(fname)
+	to_ms = header.multiplier / 1e6
+	times = stats.exclusive if metric == "exclusive" else stats.inclusive
+	procs = {}
+	for i in numpy.flatnonzero(stats.count):
+		name, function, file, line, _ = srclocs[i]
+		totals = procs.setdefault((decode(name), decode(function), decode(file), line), [0, 0.0])
+		totals[0] += int(stats.count[i])
+		totals[1] += times[i] * to_ms
+	return stats.frames, procs
+
+def compare(baseline, candidate):
+	"""
+	One row per proc seen in either capture, with times per frame so that
+	captures of different lengths can be compared.
+	"""
+	base_frames, base_procs = baseline
+	new_frames, new_procs = candidate
+	base_frames = max(base_frames, 1)
+	new_frames = max(new_frames, 1)
+	rows = []
+	for key in base_procs.keys() | new_procs.keys():
+		base_count, base_ms = base_procs.get(key, (0, 0.0))
+		new_count, new_ms = new_procs.get(key, (0, 0.0))
+		base_per_frame = base_ms / base_frames
+		new_per_frame = new_ms / new_frames
+		delta = new_per_frame - base_per_frame
+		name, function, file, line = key
+		rows.append({
+			"name": name,
+			"function": function,
+			"file": file,
+			"line": line,
+			"base_ms_per_frame": round(base_per_frame, 6),
+			"new_ms_per_frame": round(new_per_frame, 6),
+			"delta_ms_per_frame": round(delta, 6),
+			# None for procs which only show up in the candidate
+			"delta_percent": round(100 * delta / base_per_frame, 2) if base_per_frame else None,
+			"base_calls_per_frame": round(base_count / base_frames, 3),
+			"new_calls_per_frame": round(new_count / new_frames, 3),
+			"base_ms_per_call": round(base_ms / base_count, 6) if base_count else None,
+			"new_ms_per_call": round(new_ms / new_count, 6) if new_count else None,
+		})
+	rows.sort(key=lambda row: row["delta_ms_per_frame"], reverse=True)
+	return rows
+
+def _label(row):
+	label = row["name"] or row["function"] or "?"
+	if row["file"]:
+		label += f" ({row['file']}:{row['line']})"
+	return label
+
+def _format_ms(value):
+	return "-" if value is None else f"{value:.4f}"
+
+def _format_percent(value):
+	return "new" if value is None else f"{value:+.1f}%"
+
+def _print_table(title, rows, output):
+	output.write(f"{title}:\n")
+	if not rows:
+		output.write("\tnone\n")
+		return
+	output.write(f"\t{'ms/frame':>21} {'delta':>10} {'%':>8} {'ms/call':>21}  proc\n")
+	for row in rows:
+		per_frame = f"{row['base_ms_per_frame']:.4f} -> {row['new_ms_per_frame']:.4f}"
+		per_call = f"{_format_ms(row['base_ms_per_call'])} -> {_format_ms(row['new_ms_per_call'])}"
+		output.write(f"\t{per_frame:>21} {row['delta_ms_per_frame']:>+10.4f} {_format_percent(row['delta_percent']):>8} {per_call:>21}  {_label(row)}\n")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Compare per-proc costs between a baseline and a candidate .utracy capture.")
+	parser.add_argument("baseline")
+	parser.add_argument("candidate")
+	parser.add_argument("--metric", choices=("exclusive", "inclusive"), default="exclusive", help="which time to compare (default: exclusive)")
+	parser.add_argument("--threshold", type=float, default=10.0, help="fail if a proc gets slower per frame by more than this percentage (default: 10)")
+	parser.add_argument("--min-ms", type=float, default=0.01, help="ignore changes smaller than this many ms per frame (default: 0.01)")
+	parser.add_argument("--top", type=int, default=20, help="how many regressions and improvements to list (default: 20)")
+	parser.add_argument("--format", choices=("text", "csv", "json"), default="text")
+	parser.add_argument("--output", "-o", type=argparse.FileType("w", encoding="utf-8"), default=sys.stdout)
+	args = parser.parse_args()
+
+	try:
+		baseline = aggregate(args.baseline, args.metric)
+		candidate = aggregate(args.candidate, args.metric)
+	except ValueError as e:
+		print(e)
+		sys.exit(2)
+
+	rows = compare(baseline, candidate)
+	significant = [row for row in rows if abs(row["delta_ms_per_frame"]) >= args.min_ms]
+	regressions = [row for row in significant if row["delta_ms_per_frame"] > 0]
+	improvements = [row for row in reversed(significant) if row["delta_ms_per_frame"] < 0]
+	failures = [row for row in regressions if row["delta_percent"] is None or row["delta_percent"] > args.threshold]
+	regressions = regressions[:args.top]
+	improvements = improvements[:args.top]
+
+	if args.format == "json":
+		json.dump({
+			"metric": args.metric,
+			"baseline_frames": baseline[0],
+			"candidate_frames": candidate[0],
+			"threshold_percent": args.threshold,
+			"regressions": regressions,
+			"improvements": improvements,
+			"failures": failures,
+		}, args.output, indent="\t")
+		args.output.write("\n")
+	elif args.format == "csv":
+		writer = csv.DictWriter(args.output, fieldnames=list(rows[0]) if rows else ["name"], lineterminator="\n")
+		writer.writeheader()
+		writer.writerows(rows)
+	else:
+		args.output.write(f"{args.metric} time, {baseline[0]} baseline frames, {candidate[0]} candidate frames\n")
+		_print_table("Regressions", regressions, args.output)
+		_print_table("Improvements", improvements, args.output)
+		base_total = sum(row["base_ms_per_frame"] for row in rows)
+		new_total = sum(row["new_ms_per_frame"] for row in rows)
+		args.output.write(f"Total: {base_total:.4f} -> {new_total:.4f} ms/frame\n")
+
+	if failures:
+		print(f"{len(failures)} procs regressed by more than {args.threshold}%", file=sys.stderr)
+		sys.exit(1)
@@ -0,0 +1,192 @@
+import argparse
+import json
+import sys
+import numpy
+from utracy import *
+
+SpeedscopeSchema = "https://www.speedscope.app/file-format-schema.json"
+
+def _label(srcloc):
+	name, function, file, line, _ = srcloc
+	label = name or function or b"?"
+	return label.decode("utf-8", "replace")
+
+def _zone_events(events):
+	return events[(events["type"] == FileEventZoneBegin) | (events["type"] == FileEventZoneEnd)]
+
+def export_chrome(output, header, srclocs, chunks):
+	"""
+	Write Chrome's Trace Event Format, which chrome://tracing and Perfetto
+	open. Zones become begin/end events and frame marks global instant
+	events, written out a chunk at a time as they are read.
+	"""
+	to_us = header.multiplier / 1e3
+	pid = header.pid
+	# everything but the thread and timestamp is the same for every begin of a srcloc
+	begins = []
+	for srcloc in srclocs:
+		name, function, file, line, _ = srcloc
+		begins.append(json.dumps({
+			"name": _label(srcloc),
+			"cat": "zone",
+			"args": {
+				"function": (function or b"").decode("utf-8", "replace"),
+				"file": (file or b"").decode("utf-8", "replace"),
+				"line": line,
+			},
+		})[1:])
+
+	output.write('{"displayTimeUnit":"ms","traceEvents":[\n')
+	output.write(json.dumps({"ph": "M", "name": "process_name", "pid": pid, "args": {"name": header.program_name.decode("utf-8", "replace")}}))
+	for events in chunks:
+		events = events[events["type"] != FileEventZoneColor]
+		lines = []
+		for event_type, tid, srcloc, timestamp in zip(
+			events["type"].tolist(),
+			events["tid"].tolist(),
+			events["srcloc"].tolist(),
+			(events["timestamp"] * to_us).tolist(),
+		):
+			if event_type == FileEventZoneBegin:
+				lines.append(f'{{"ph":"B","pid":{pid},"tid":{tid},"ts":{timestamp:.3f},{begins[srcloc]}')
+			elif event_type == FileEventZoneEnd:
+				lines.append(f'{{"ph":"E","pid":{pid},"tid":{tid},"ts":{timestamp:.3f}}}')
+			else:
+				lines.append(f'{{"ph":"i","s":"g","name":"frame","pid":{pid},"tid":0,"ts":{timestamp:.3f}}}')
+		if lines:
+			output.write(",\n")
+			output.write(",\n".join(lines))
+	output.write("\n]}\n")
+
+def export_speedscope(output, header, srclocs, open_chunks):
+	"""
+	Write speedscope's evented format, one profile per thread. Each
+	profile has to be written in one piece, so the events are read once
+	to find the threads and then once more for each of them.
+	"""
+	to_ns = header.multiplier
+	tids = set()
+	for events in open_chunks():
+		tids.update(numpy.unique(_zone_events(events)["tid"]).tolist())
+
+	output.write(f'{{"$schema":{json.dumps(SpeedscopeSchema)},"exporter":"tracy_replay export.py","name":{json.dumps(header.program_name.decode("utf-8", "replace"))},"activeProfileIndex":0,')
+	frames = []
+	for srcloc in srclocs:
+		name, function, file, line, _ = srcloc
+		frame = {"name": _label(srcloc), "line": line}
+		if file:
+			frame["file"] = file.decode("utf-8", "replace")
+		frames.append(frame)
+	output.write(f'"shared":{{"frames":{json.dumps(frames)}}},"profiles":[')
+
+	for i, thread in enumerate(sorted(tids)):
+		if i:
+			output.write(",")
+		output.write(f'{{"type":"evented","name":"thread {thread}","unit":"nanoseconds","events":[')
+		stack = []
+		start = end = None
+		separator = "\n"
+		for events in open_chunks():
+			events = _zone_events(events)
+			events = events[events["tid"] == thread]
+			lines = []
+			for event_type, srcloc, timestamp in zip(
+				events["type"].tolist(),
+				events["srcloc"].tolist(),
+				(events["timestamp"] * to_ns).tolist(),
+			):
+				if event_type == FileEventZoneBegin:
+					stack.append(srcloc)
+					lines.append(f'{{"type":"O","frame":{srcloc},"at":{timestamp:.0f}}}')
+				elif stack:
+					# ends don't say which zone they close, it's always the innermost one
+					lines.append(f'{{"type":"C","frame":{stack.pop()},"at":{timestamp:.0f}}}')
+				else:
+					continue
+				if start is None:
+					start = timestamp
+				end = timestamp
+			if lines:
+				output.write(separator)
+				output.write(",\n".join(lines))
+				separator = ",\n"
+		# speedscope wants every zone closed
+		closing = [f'{{"type":"C","frame":{srcloc},"at":{end:.0f}}}' for srcloc in reversed(stack)]
+		if closing:
+			output.write(separator)
+			output.write(",\n".join(closing))
+		output.write(f'\n],"startValue":{start or 0:.0f},"endValue":{end or 0:.0f}}}')
+	output.write("]}\n")
+
+def export_folded(output, header, srclocs, chunks):
+	"""
+	Write collapsed stacks, one "outer;inner;innermost nanoseconds" line per
+	distinct stack with the exclusive time spent in it, as read by
+	flamegraph.pl, inferno and speedscope. Only the totals are kept in
+	memory, not the events.
+	"""
+	to_ns = header.multiplier
+	labels = [_label(srcloc).replace(";", ":") for srcloc in srclocs]
+	# tid -> stack of [srcloc, begin timestamp, time spent in children]
+	stacks = {}
+	totals = {}
+	for events in chunks:
+		events = _zone_events(events)
+		for event_type, tid, srcloc, timestamp in zip(
+			events["type"].tolist(),
+			events["tid"].tolist(),
+			events["srcloc"].tolist(),
+			events["timestamp"].tolist(),
+		):
+			stack = stacks.setdefault(tid, [])
+			if event_type == FileEventZoneBegin:
+				stack.append([srcloc, timestamp, 0])
+			elif stack:
+				key = tuple(zone[0] for zone in stack)
+				srcloc, begin, children = stack.pop()
+				duration = timestamp - begin
+				totals[key] = totals.get(key, 0) + duration - children
+				if stack:
+					stack[-1][2] += duration
+
+	for key, total in sorted(totals.items()):
+		value = round(total * to_ns)
+		if value > 0:
+			output.write(f"{';'.join(labels[srcloc] for srcloc in key)} {value}\n")
+
+Formats = {
+	"chrome": export_chrome,
+	"speedscope": export_speedscope,
+	"folded": export_folded,
+}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Convert a .utracy capture for browser based profilers and flamegraph tools.")
+	parser.add_argument("file")
+	parser.add_argument("output", type=argparse.FileType("w", encoding="utf-8"))
+	parser.add_argument("--format", choices=Formats, default="chrome", help="chrome trace event JSON, speedscope JSON, or folded stacks (default: chrome)")
+	add_slice_arguments(parser)
+	args = parser.parse_args()
+
+	try:
+		reader = CaptureReader(args.file)
+	except ValueError as e:
+		print(e)
+		sys.exit(1)
+
+	with reader:
+		try:
+			index, frames = resolve_slice(args, args.file, reader.header)
+		except ValueError as e:
+			print(e)
+			sys.exit(1)
+
+		def open_chunks():
+			if index:
+				return index.read_slice(reader, *frames)
+			return reader.chunks()
+
+		if args.format == "speedscope":
+			export_speedscope(args.output, reader.header, reader.srclocs, open_chunks)
+		else:
+			Formats[args.format](args.output, reader.header, reader.srclocs, open_chunks())
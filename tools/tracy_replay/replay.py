@@ -1,77 +1,12 @@
 import argparse
+import asyncio
 import ctypes
-import socket
-import selectors
 import lz4.stream
+import numpy
+from utracy import *
 
-# file protocol
-FileSignature = 0x6D64796361727475
-FileVersion = 2
-FileEventZoneBegin =15
-FileEventZoneEnd = 17
-FileEventZoneColor = 62
-FileEventFrameMark = 64
-
-class FileHeader(ctypes.Structure):
-	_fields_ = (
-		("signature", ctypes.c_ulonglong),
-		("version", ctypes.c_uint),
-		("multiplier", ctypes.c_double),
-		("init_begin", ctypes.c_longlong),
-		("init_end", ctypes.c_longlong),
-		("delay", ctypes.c_longlong),
-		("resolution", ctypes.c_longlong),
-		("epoch", ctypes.c_longlong),
-		("exec_time", ctypes.c_longlong),
-		("pid", ctypes.c_longlong),
-		("sampling_period", ctypes.c_longlong),
-		("flags", ctypes.c_byte),
-		("cpu_arch", ctypes.c_byte),
-		("cpu_manufacturer", ctypes.c_char * 12),
-		("cpu_id", ctypes.c_uint),
-		("program_name", ctypes.c_char * 64),
-		("host_info", ctypes.c_char * 1024)
-	)
-
-class FileZoneBegin(ctypes.Structure):
-	_fields_ = (
-		("tid", ctypes.c_uint32),
-		("srcloc", ctypes.c_uint32),
-		("timestamp", ctypes.c_int64)
-	)
-
-class FileZoneEnd(ctypes.Structure):
-	_fields_ = (
-		("tid", ctypes.c_uint32),
-		("timestamp", ctypes.c_int64)
-	)
-
-class FileZoneColor(ctypes.Structure):
-	_fields_ = (
-		("tid", ctypes.c_uint32),
-		("color", ctypes.c_uint32)
-	)
-
-class FileFrameMark(ctypes.Structure):
-	_fields_ = (
-		("name", ctypes.c_uint32),
-		("timestamp", ctypes.c_int64)
-	)
-
-class FileEvent(ctypes.Structure):
-	class Events(ctypes.Union):
-		_fields_ = (
-			("zone_begin", FileZoneBegin),
-			("zone_end", FileZoneEnd),
-			("zone_color", FileZoneColor),
-			("frame_mark", FileFrameMark),
-		)
-
-	_anonymous_ = ("event",)
-	_fields_ = (
-		("type", ctypes.c_byte),
-		("event", Events)
-	)
+# clients which send no query for this many seconds are done, as capture never disconnects
+NetworkIdleTimeout = 1
 
 # network protocol
 NetworkMaxFrameSize = 256 * 1024
@@ -188,245 +123,314 @@ class NetworkRequest(ctypes.Structure):
 		("extra", ctypes.c_uint32)
 	)
 
-def main(stream):
-	def file_read_uint():
-		ctype = ctypes.c_uint()
-		stream.readinto(ctype)
-		return ctype.value
-
-	def file_read_chars(size):
-		if 0 == size:
-			return None
-		ctype = (ctypes.c_char * size)()
-		stream.readinto(ctype)
-		return ctype.value
-
-	header = FileHeader()
-	stream.readinto(header)
-	if header.signature != FileSignature:
-		print("incorrect signature")
-		return
-
-	if header.version != FileVersion:
-		print("incorrect version")
-		return
-
-	srclocs_len = file_read_uint()
-	strings = {}
-	srclocs = [None] * srclocs_len
-
-	for i in range(srclocs_len):
-		name_len = file_read_uint()
-		name = file_read_chars(name_len)
-		function_len = file_read_uint()
-		function = file_read_chars(function_len)
-		file_len = file_read_uint()
-		file = file_read_chars(file_len)
-		line = file_read_uint()
-		color = file_read_uint()
-
-		if name != None:
-			digest = hash(name)
-			strings[digest] = name
-			name = digest
-		else:
-			name = 0
-
-		if function != None:
-			digest = hash(function)
-			strings[digest] = function
-			function = digest
-		else:
-			function = 0
-
-		if file != None:
-			digest = hash(file)
-			strings[digest] = file
-			file = digest
-		else:
-			file = 0
-
-		srclocs[i] = (name, function, file, line, color)
-
-	server = socket.create_server(("127.0.0.1", 8086))
-	server.listen(1)
-	print("listening on 127.0.0.1:8086...")
-	client, addr = server.accept()
-
-	if client.recv(8) != b"TracyPrf":
-		print("bad client")
-		client.close()
-		return
-
-	protocol = ctypes.c_uint()
-	client.recv_into(protocol)
-
-	if protocol.value not in (56, 57):
-		print("bad protocol")
-		client.sendall(NetworkHandshakeProtocolMismatch)
-		client.close()
-		return
-
-	print(f"client accepted from {addr}")
-	client.sendall(NetworkHandshakeWelcome)
-
-	client.sendall(NetworkHeader(
-		multiplier = header.multiplier,
-		init_begin = header.init_begin,
-		init_end = header.init_end,
-		delay = header.delay,
-		resolution = header.resolution,
-		epoch = header.epoch,
-		exec_time = header.exec_time,
-		pid = header.pid,
-		sampling_period = header.sampling_period,
-		flags = header.flags,
-		cpu_arch = header.cpu_arch,
-		cpu_manufacturer = header.cpu_manufacturer,
-		cpu_id = header.cpu_id,
-		program_name = header.program_name,
-		host_info = header.host_info
-	))
-
-	event = FileEvent()
-	event_sz = ctypes.sizeof(event)
-	timestamp = 0
-	tid = None
-	buffer = bytearray(NetworkMaxFrameSize // event_sz)
-	offset = 0
-	compressor = lz4.stream.LZ4StreamCompressor(
-		"double_buffer",
-		NetworkMaxFrameSize,
-		store_comp_size = 4
-	)
+NetworkThreadContextDtype = numpy.dtype(NetworkThreadContext)
+NetworkZoneBeginDtype = numpy.dtype(NetworkZoneBegin)
+NetworkZoneEndDtype = numpy.dtype(NetworkZoneEnd)
+NetworkZoneColorDtype = numpy.dtype(NetworkZoneColor)
+NetworkFrameMarkDtype = numpy.dtype(NetworkFrameMark)
+
+class EventEncoder:
+	"""
+	Converts chunks of file events into the network messages Tracy expects,
+	a whole chunk at a time. Zone timestamps are sent as deltas from the
+	previous zone event on the same thread, and a thread context message is
+	inserted whenever the thread changes, so that state is carried over
+	between chunks.
+	"""
+	def __init__(self):
+		self.tid = -1
+		self.timestamp = 0
+
+	def encode(self, events):
+		"""
+		Returns the encoded messages as a numpy byte array, along with the
+		offset each message ends at. A thread context message and the zone
+		event it precedes count as one message, so are never split up.
+		"""
+		types = events["type"]
+		events = events[numpy.isin(types, (FileEventZoneBegin, FileEventZoneEnd, FileEventZoneColor, FileEventFrameMark))]
+		types = events["type"]
+		timestamps = events["timestamp"]
+
+		# which zone events switch to another thread
+		zones = numpy.flatnonzero(types != FileEventFrameMark)
+		tids = events["tid"][zones].astype(numpy.int64)
+		switches = tids != numpy.concatenate(([self.tid], tids[:-1]))
+		# zone events are grouped into runs on one thread, run 0 carries on from the last chunk
+		runs = numpy.cumsum(switches)
+
+		# delta timestamps, only begins and ends count, colors don't touch the timestamp
+		timed = types[zones] != FileEventZoneColor
+		timed_zones = zones[timed]
+		timed_runs = runs[timed]
+		timed_timestamps = timestamps[timed_zones]
+		previous = numpy.concatenate(([self.timestamp], timed_timestamps[:-1]))
+		previous_runs = numpy.concatenate(([0], timed_runs[:-1]))
+		deltas = timed_timestamps - numpy.where(timed_runs == previous_runs, previous, 0)
+
+		if len(zones):
+			self.tid = int(tids[-1])
+			if len(timed_zones) and timed_runs[-1] == runs[-1]:
+				self.timestamp = int(timed_timestamps[-1])
+			elif runs[-1] > 0:
+				self.timestamp = 0
+
+		# lay out every message back to back
+		message_sizes = numpy.zeros(len(events), dtype=numpy.int64)
+		for event_type, dtype in (
+			(FileEventZoneBegin, NetworkZoneBeginDtype),
+			(FileEventZoneEnd, NetworkZoneEndDtype),
+			(FileEventZoneColor, NetworkZoneColorDtype),
+			(FileEventFrameMark, NetworkFrameMarkDtype),
+		):
+			message_sizes[types == event_type] = dtype.itemsize
+		context_sizes = numpy.zeros(len(events), dtype=numpy.int64)
+		context_sizes[zones[switches]] = NetworkThreadContextDtype.itemsize
+		ends = numpy.cumsum(context_sizes + message_sizes)
+		offsets = ends - message_sizes
+		data = numpy.empty(ends[-1] if len(ends) else 0, dtype=numpy.uint8)
+
+		def scatter(starts, records):
+			size = records.dtype.itemsize
+			data[starts[:, None] + numpy.arange(size)] = records.view(numpy.uint8).reshape(-1, size)
+
+		switched = zones[switches]
+		records = numpy.zeros(len(switched), NetworkThreadContextDtype)
+		records["type"] = NetworkEventThreadContext
+		records["tid"] = tids[switches]
+		scatter(offsets[switched] - NetworkThreadContextDtype.itemsize, records)
+
+		begins = numpy.flatnonzero(types[timed_zones] == FileEventZoneBegin)
+		records = numpy.zeros(len(begins), NetworkZoneBeginDtype)
+		records["type"] = NetworkEventZoneBegin
+		records["timestamp"] = deltas[begins]
+		records["srcloc"] = events["srcloc"][timed_zones[begins]]
+		scatter(offsets[timed_zones[begins]], records)
+
+		zone_ends = numpy.flatnonzero(types[timed_zones] == FileEventZoneEnd)
+		records = numpy.zeros(len(zone_ends), NetworkZoneEndDtype)
+		records["type"] = NetworkEventZoneEnd
+		records["timestamp"] = deltas[zone_ends]
+		scatter(offsets[timed_zones[zone_ends]], records)
+
+		colors = zones[~timed]
+		color = events["color"][colors]
+		records = numpy.zeros(len(colors), NetworkZoneColorDtype)
+		records["type"] = NetworkEventZoneColor
+		records["r"] = (color >> 0x00) & 0xFF
+		records["g"] = (color >> 0x08) & 0xFF
+		records["b"] = (color >> 0x10) & 0xFF
+		scatter(offsets[colors], records)
+
+		marks = numpy.flatnonzero(types == FileEventFrameMark)
+		records = numpy.zeros(len(marks), NetworkFrameMarkDtype)
+		records["type"] = NetworkEventFrameMark
+		records["timestamp"] = timestamps[marks]
+		scatter(offsets[marks], records)
+
+		return data, ends
+
+def string_table(srclocs):
+	"""
+	Give every distinct string in the srcloc table a sequential id, which is
+	what Tracy will later ask for it by. Returns ({id: string}, srclocs with
+	ids in place of strings). 0 means there is no string.
+	"""
+	ids = {}
+	def intern(string):
+		if string is None:
+			return 0
+		return ids.setdefault(string, len(ids) + 1)
+
+	srclocs = [(intern(name), intern(function), intern(file), line, color) for name, function, file, line, color in srclocs]
+	return {id: string for string, id in ids.items()}, srclocs
+
+class Capture:
+	"""
+	A capture decoded and encoded into network messages ahead of time, so
+	that it can be sent to any number of clients without reading the file
+	again. Only the lz4 compression is done per client.
+	"""
+	def __init__(self, header, srclocs, events):
+		self.header = bytes(NetworkHeader(
+			multiplier = header.multiplier,
+			init_begin = header.init_begin,
+			init_end = header.init_end,
+			delay = header.delay,
+			resolution = header.resolution,
+			epoch = header.epoch,
+			exec_time = header.exec_time,
+			pid = header.pid,
+			sampling_period = header.sampling_period,
+			flags = header.flags,
+			cpu_arch = header.cpu_arch,
+			cpu_manufacturer = header.cpu_manufacturer,
+			cpu_id = header.cpu_id,
+			program_name = header.program_name,
+			host_info = header.host_info
+		))
+		self.strings, self.srclocs = string_table(srclocs)
+
+		# message data cut into blocks of at most one network frame, at message boundaries
+		self.blocks = []
+		encoder = EventEncoder()
+		for chunk in events:
+			data, ends = encoder.encode(chunk)
+			view = memoryview(data)
+			start = 0
+			while start < len(data):
+				# as many whole messages as fit in one frame
+				stop = ends[numpy.searchsorted(ends, start + NetworkMaxFrameSize, side="right") - 1]
+				self.blocks.append(view[start:stop])
+				start = stop
+
+	def respond(self, req):
+		"""
+		The response to a query from the client, or None if there isn't one.
+		"""
+		def string_data(string, type):
+			string_sz = len(string)
+
+			class NetworkStringData(ctypes.Structure):
+				_pack_ = 1
+				_fields_ = (
+					("type", ctypes.c_uint8),
+					("ptr", ctypes.c_uint64),
+					("len", ctypes.c_uint16),
+					("str", ctypes.c_char * string_sz)
+				)
+
+			return NetworkStringData(
+				type = type,
+				ptr = req.ptr,
+				len = string_sz,
+				str = string
+			)
 
-	def commit():
-		nonlocal offset
-		if offset > 0:
-			block = compressor.compress(buffer[:offset])
-			client.sendall(block)
-			offset = 0
-
-	def write_msg(msg):
-		nonlocal offset, buffer
-		sz = ctypes.sizeof(msg)
-		if offset + sz > len(buffer):
-			commit()
-
-		buffer[offset : offset + sz] = msg
-		offset += sz
-
-	def thread_context(event):
-		nonlocal tid, timestamp
-		if event.zone_begin.tid != tid:
-			tid = event.zone_begin.tid
-			timestamp = 0
-			write_msg(NetworkThreadContext(
-				type = NetworkEventThreadContext,
-				tid = tid
+		if req.type == NetworkQuerySrcloc:
+			srcloc = self.srclocs[req.ptr]
+			return bytes(NetworkSrcloc(
+				type = NetworkEventSrcloc,
+				name = srcloc[0],
+				function = srcloc[1],
+				file = srcloc[2],
+				line = srcloc[3],
+				r = (srcloc[4] >> 0x00) & 0xFF,
+				g = (srcloc[4] >> 0x08) & 0xFF,
+				b = (srcloc[4] >> 0x10) & 0xFF
 			))
 
-	while event_sz == stream.readinto(event):
-		if event.type == FileEventZoneBegin:
-			thread_context(event)
-			write_msg(NetworkZoneBegin(
-				type = NetworkEventZoneBegin,
-				timestamp = event.zone_begin.timestamp - timestamp,
-				srcloc = event.zone_begin.srcloc
-			))
-			timestamp = event.zone_begin.timestamp
+		elif req.type == NetworkQueryString:
+			return bytes(string_data(self.strings[req.ptr], NetworkResponseStringData))
 
-		elif event.type == FileEventZoneEnd:
-			thread_context(event)
-			write_msg(NetworkZoneEnd(
-				type = NetworkEventZoneEnd,
-				timestamp = event.zone_end.timestamp - timestamp
-			))
-			timestamp = event.zone_end.timestamp
-
-		elif event.type == FileEventZoneColor:
-			thread_context(event)
-			write_msg(NetworkZoneColor(
-				type = NetworkEventZoneColor,
-				r = (event.zone_color.color >> 0x00) & 0xFF,
-				g = (event.zone_color.color >> 0x08) & 0xFF,
-				b = (event.zone_color.color >> 0x10) & 0xFF
-			))
+		elif req.type == NetworkQuerySymbolCode:
+			return bytes(ctypes.c_uint8(NetworkResponseSymbolCodeNotAvailable))
 
-		elif event.type == FileEventFrameMark:
-			write_msg(NetworkFrameMark(
-				type = NetworkEventFrameMark,
-				name = 0,
-				timestamp = event.frame_mark.timestamp
-			))
-
-	commit()
+		elif req.type == NetworkQuerySourceCode:
+			return bytes(ctypes.c_uint8(NetworkResponseSourceCodeNotAvailable))
 
-	def respond_string(string, ptr, type):
-		string_sz = len(string)
+		elif req.type == NetworkQueryDataTransfer:
+			return bytes(ctypes.c_uint8(NetworkResponseServerQueryNoop))
 
-		class NetworkStringData(ctypes.Structure):
-			_pack_ = 1
-			_fields_ = (
-				("type", ctypes.c_uint8),
-				("ptr", ctypes.c_uint64),
-				("len", ctypes.c_uint16),
-				("str", ctypes.c_char * string_sz)
-			)
+		elif req.type == NetworkQueryDataTransferPart:
+			return bytes(ctypes.c_uint8(NetworkResponseServerQueryNoop))
 
-		write_msg(NetworkStringData(
-			type = type,
-			ptr = req.ptr,
-			len = string_sz,
-			str = string
-		))
+		elif req.type == NetworkQueryThreadString:
+			return bytes(string_data(b"main", NetworkResponseThreadName))
 
-	req = NetworkRequest()
-	client.settimeout(1)
+		print("unknown req:", req.type)
+		return None
 
+async def serve_client(capture, reader, writer):
+	addr = writer.get_extra_info("peername")
 	try:
-		while ctypes.sizeof(req) == client.recv_into(req):
-			if req.type == NetworkQuerySrcloc:
-				srcloc = srclocs[req.ptr]
-				write_msg(NetworkSrcloc(
-					type = NetworkEventSrcloc,
-					name = srcloc[0],
-					function = srcloc[1],
-					file = srcloc[2],
-					line = srcloc[3],
-					r = (srcloc[4] >> 0x00) & 0xFF,
-					g = (srcloc[4] >> 0x08) & 0xFF,
-					b = (srcloc[4] >> 0x10) & 0xFF
-				))
-
-			elif req.type == NetworkQueryString:
-				respond_string(strings[req.ptr], req.ptr, NetworkResponseStringData)
-
-			elif req.type == NetworkQuerySymbolCode:
-				write_msg(ctypes.c_uint8(NetworkResponseSymbolCodeNotAvailable))
+		if await reader.readexactly(8) != b"TracyPrf":
+			print("bad client")
+			return
+
+		protocol = ctypes.c_uint.from_buffer_copy(await reader.readexactly(ctypes.sizeof(ctypes.c_uint)))
+		if protocol.value not in (56, 57):
+			print("bad protocol")
+			writer.write(NetworkHandshakeProtocolMismatch)
+			await writer.drain()
+			return
+
+		print(f"client accepted from {addr}")
+		writer.write(NetworkHandshakeWelcome)
+		writer.write(capture.header)
+
+		# every client gets its own lz4 stream, as each block depends on the ones before it
+		compressor = lz4.stream.LZ4StreamCompressor(
+			"double_buffer",
+			NetworkMaxFrameSize,
+			store_comp_size = 4
+		)
+		for block in capture.blocks:
+			writer.write(compressor.compress(block))
+			await writer.drain()
+		print(f"sent capture to {addr}")
+
+		while True:
+			try:
+				data = await asyncio.wait_for(reader.readexactly(ctypes.sizeof(NetworkRequest)), NetworkIdleTimeout)
+			except asyncio.TimeoutError:
+				break
+			req = NetworkRequest.from_buffer_copy(data)
+			if req.type == NetworkQueryDisconnect:
+				break
+			response = capture.respond(req)
+			if response is not None:
+				writer.write(compressor.compress(response))
+				await writer.drain()
+
+	except (asyncio.IncompleteReadError, ConnectionError):
+		pass
 
-			elif req.type == NetworkQuerySourceCode:
-				write_msg(ctypes.c_uint8(NetworkResponseSourceCodeNotAvailable))
+	finally:
+		writer.close()
+		print(f"client {addr} disconnected")
 
-			elif req.type == NetworkQueryDataTransfer:
-				write_msg(ctypes.c_uint8(NetworkResponseServerQueryNoop))
+async def serve(capture, host, port):
+	server = await asyncio.start_server(lambda reader, writer: serve_client(capture, reader, writer), host, port)
+	print(f"listening on {host}:{port}...")
+	async with server:
+		await server.serve_forever()
 
-			elif req.type == NetworkQueryDataTransferPart:
-				write_msg(ctypes.c_uint8(NetworkResponseServerQueryNoop))
+def main(fname, args):
+	try:
+		reader = CaptureReader(fname)
+	except ValueError as e:
+		print(e)
+		return
 
-			elif req.type == NetworkQueryThreadString:
-				respond_string(b"main", req.ptr, NetworkResponseThreadName)
+	with reader:
+		try:
+			index, frames = resolve_slice(args, fname, reader.header)
+		except ValueError as e:
+			print(e)
+			return
 
-			else:
-				print("unknown req:", req.type)
+		if index:
+			print(f"replaying frames {frames[0]} to {frames[1]} of {len(index)}")
+			events = index.read_slice(reader, *frames)
+		else:
+			events = reader.chunks()
 
-			commit()
+		# the capture is encoded into its own buffers, so the file can be closed
+		capture = Capture(reader.header, reader.srclocs, events)
+		events = None
+	print(f"encoded {len(capture.blocks)} blocks of messages")
 
-	except socket.timeout:
+	try:
+		asyncio.run(serve(capture, args.host, args.port))
+	except KeyboardInterrupt:
 		pass
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser()
-	parser.add_argument("file", type=argparse.FileType("rb"))
+	parser.add_argument("file")
+	parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+	parser.add_argument("--port", type=int, default=8086, help="port to listen on (default: 8086)")
+	add_slice_arguments(parser)
 	args = parser.parse_args()
-	main(args.file)
+	main(args.file, args)
@@ -0,0 +1,36 @@
+import argparse
+import sys
+import numpy
+from utracy import *
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description = "Cut a range of frames out of a .utracy capture into a smaller one.")
+	parser.add_argument("file")
+	parser.add_argument("output", type=argparse.FileType("wb"))
+	add_slice_arguments(parser)
+	args = parser.parse_args()
+
+	try:
+		reader = CaptureReader(args.file)
+	except ValueError as e:
+		print(e)
+		sys.exit(1)
+
+	with reader:
+		try:
+			index, frames = resolve_slice(args, args.file, reader.header)
+		except ValueError as e:
+			print(e)
+			sys.exit(1)
+
+		if not index:
+			print("give --from/--to or --frames to choose what to keep")
+			sys.exit(1)
+
+		# the header and srcloc table are kept as they are
+		with open(args.file, "rb") as stream:
+			args.output.write(stream.read(reader.events_offset))
+		for events in index.read_slice(reader, *frames):
+			args.output.write(events.view(numpy.uint8).data)
+		events = None
+	print(f"wrote frames {frames[0]} to {frames[1]} of {len(index)}")
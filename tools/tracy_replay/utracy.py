@@ -0,0 +1,467 @@
+import ctypes
+import mmap
+import os
+import numpy
+
+# file protocol
+FileSignature = 0x6D64796361727475
+FileVersion = 2
+FileEventZoneBegin =15
+FileEventZoneEnd = 17
+FileEventZoneColor = 62
+FileEventFrameMark = 64
+
+# events are decoded this many at a time, about 24MB per chunk
+EventChunkSize = 1024 * 1024
+
+class FileHeader(ctypes.Structure):
+	_fields_ = (
+		("signature", ctypes.c_ulonglong),
+		("version", ctypes.c_uint),
+		("multiplier", ctypes.c_double),
+		("init_begin", ctypes.c_longlong),
+		("init_end", ctypes.c_longlong),
+		("delay", ctypes.c_longlong),
+		("resolution", ctypes.c_longlong),
+		("epoch", ctypes.c_longlong),
+		("exec_time", ctypes.c_longlong),
+		("pid", ctypes.c_longlong),
+		("sampling_period", ctypes.c_longlong),
+		("flags", ctypes.c_byte),
+		("cpu_arch", ctypes.c_byte),
+		("cpu_manufacturer", ctypes.c_char * 12),
+		("cpu_id", ctypes.c_uint),
+		("program_name", ctypes.c_char * 64),
+		("host_info", ctypes.c_char * 1024)
+	)
+
+class FileZoneBegin(ctypes.Structure):
+	_fields_ = (
+		("tid", ctypes.c_uint32),
+		("srcloc", ctypes.c_uint32),
+		("timestamp", ctypes.c_int64)
+	)
+
+class FileZoneEnd(ctypes.Structure):
+	_fields_ = (
+		("tid", ctypes.c_uint32),
+		("timestamp", ctypes.c_int64)
+	)
+
+class FileZoneColor(ctypes.Structure):
+	_fields_ = (
+		("tid", ctypes.c_uint32),
+		("color", ctypes.c_uint32)
+	)
+
+class FileFrameMark(ctypes.Structure):
+	_fields_ = (
+		("name", ctypes.c_uint32),
+		("timestamp", ctypes.c_int64)
+	)
+
+class FileEvent(ctypes.Structure):
+	class Events(ctypes.Union):
+		_fields_ = (
+			("zone_begin", FileZoneBegin),
+			("zone_end", FileZoneEnd),
+			("zone_color", FileZoneColor),
+			("frame_mark", FileFrameMark),
+		)
+
+	_anonymous_ = ("event",)
+	_fields_ = (
+		("type", ctypes.c_byte),
+		("event", Events)
+	)
+
+def _event_dtype():
+	# FileEvent as a numpy dtype, with the union members flattened into
+	# overlapping fields at the same offsets ctypes gives them
+	event = FileEvent.event.offset
+	fields = {
+		"type": (numpy.int8, FileEvent.type.offset),
+		"tid": (numpy.uint32, event + FileZoneBegin.tid.offset),
+		"srcloc": (numpy.uint32, event + FileZoneBegin.srcloc.offset),
+		"color": (numpy.uint32, event + FileZoneColor.color.offset),
+		"name": (numpy.uint32, event + FileFrameMark.name.offset),
+		"timestamp": (numpy.int64, event + FileZoneBegin.timestamp.offset),
+	}
+	# every timestamp must line up for the flattened field to be valid
+	assert FileZoneBegin.timestamp.offset == FileZoneEnd.timestamp.offset == FileFrameMark.timestamp.offset
+	return numpy.dtype({
+		"names": list(fields),
+		"formats": [fmt for fmt, _ in fields.values()],
+		"offsets": [offset for _, offset in fields.values()],
+		"itemsize": ctypes.sizeof(FileEvent),
+	})
+
+EventDtype = _event_dtype()
+
+def read_header(stream):
+	header = FileHeader()
+	stream.readinto(header)
+	return header
+
+def read_srclocs(stream):
+	"""
+	Read the srcloc table which follows the header. Each entry is a
+	(name, function, file, line, color) tuple, with missing strings as None.
+	"""
+	def file_read_uint():
+		ctype = ctypes.c_uint()
+		stream.readinto(ctype)
+		return ctype.value
+
+	def file_read_chars(size):
+		if 0 == size:
+			return None
+		ctype = (ctypes.c_char * size)()
+		stream.readinto(ctype)
+		return ctype.value
+
+	srclocs_len = file_read_uint()
+	srclocs = [None] * srclocs_len
+
+	for i in range(srclocs_len):
+		name = file_read_chars(file_read_uint())
+		function = file_read_chars(file_read_uint())
+		file = file_read_chars(file_read_uint())
+		line = file_read_uint()
+		color = file_read_uint()
+		srclocs[i] = (name, function, file, line, color)
+
+	return srclocs
+
+def read_events(stream, chunk_size=EventChunkSize):
+	"""
+	Yield the remaining events in the stream as numpy arrays of EventDtype,
+	up to chunk_size events at a time. A partial event at the end of the
+	file is ignored.
+	"""
+	event_sz = EventDtype.itemsize
+	while True:
+		data = stream.read(chunk_size * event_sz)
+		count = len(data) // event_sz
+		if count:
+			yield numpy.frombuffer(data, EventDtype, count)
+		if count < chunk_size:
+			return
+
+class CaptureReader:
+	"""
+	Random access to a capture through a memory map. `events` is a numpy
+	array over the whole event section of the file, so any range of it can
+	be used without copying or reading the rest of the file. A FrameIndex
+	says where each frame is. Any views taken of `events` must be dropped
+	before the reader is closed.
+	"""
+	def __init__(self, fname):
+		with open(fname, "rb") as stream:
+			self.header = read_header(stream)
+			if self.header.signature != FileSignature:
+				raise ValueError("incorrect signature")
+			if self.header.version != FileVersion:
+				raise ValueError("incorrect version")
+			self.srclocs = read_srclocs(stream)
+			self.events_offset = stream.tell()
+			self._mmap = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+
+		count = (len(self._mmap) - self.events_offset) // EventDtype.itemsize
+		self.events = numpy.frombuffer(self._mmap, EventDtype, count, self.events_offset) if count else numpy.zeros(0, EventDtype)
+
+	def close(self):
+		self.events = None
+		self._mmap.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def chunks(self, start=0, stop=None, size=EventChunkSize):
+		"""
+		Yield views of the events from position `start` to `stop`, up to
+		`size` events at a time, like read_events() but without copying.
+		"""
+		stop = len(self.events) if stop is None else stop
+		for first in range(start, stop, size):
+			yield self.events[first:min(first + size, stop)]
+
+def _empty_zones(*fields):
+	return {field: numpy.zeros(0, numpy.int64) for field in fields}
+
+class ZonePairer:
+	"""
+	Matches up the begin and end events of zones, a chunk of events at a time.
+
+	This doesn't replay the zone stack event by event: within one thread, the
+	begins and ends at any given nesting level strictly alternate, so after
+	sorting by (thread, level, position) each begin sits right before its end.
+	Zones still open at the end of a chunk are carried over to the next one.
+	"""
+	def __init__(self):
+		# position of the next event, counting from the first event in the file
+		self.position = 0
+		# nesting depth of each thread, and the zones open at the end of the last chunk
+		self._depths = {}
+		self.open = _empty_zones("tid", "level", "srcloc", "begin", "begin_timestamp", "children")
+
+	def add(self, events):
+		"""
+		Pair up the zones in the next chunk of events. Returns the zones which
+		ended in this chunk as a dict of arrays: tid, level, srcloc, the begin
+		and end event positions and timestamps, and children, the total time
+		spent in direct child zones.
+		"""
+		first = self.position
+		self.position += len(events)
+
+		types = events["type"]
+		mask = (types == FileEventZoneBegin) | (types == FileEventZoneEnd)
+		zones = events[mask]
+		if not len(zones):
+			return _empty_zones("tid", "level", "srcloc", "begin", "end", "begin_timestamp", "end_timestamp", "children")
+
+		is_begin = zones["type"] == FileEventZoneBegin
+		tids = zones["tid"].astype(numpy.int64)
+
+		# depth after each event, per thread, carrying on from the last chunk
+		steps = numpy.where(is_begin, 1, -1)
+		depths = numpy.empty(len(zones), numpy.int64)
+		for tid in numpy.unique(tids):
+			thread = tids == tid
+			depths[thread] = self._depths.get(tid, 0) + numpy.cumsum(steps[thread])
+			self._depths[tid] = int(depths[thread][-1])
+		# a begin sits at the level it opens, an end at the level it closes
+		levels = numpy.where(is_begin, depths, depths + 1)
+
+		# still-open zones from earlier chunks go first, in the order they began
+		carried = len(self.open["tid"])
+		tids = numpy.concatenate((self.open["tid"], tids))
+		levels = numpy.concatenate((self.open["level"], levels))
+		is_begin = numpy.concatenate((numpy.ones(carried, bool), is_begin))
+		srclocs = numpy.concatenate((self.open["srcloc"], zones["srcloc"].astype(numpy.int64)))
+		positions = numpy.concatenate((self.open["begin"], first + numpy.flatnonzero(mask)))
+		timestamps = numpy.concatenate((self.open["begin_timestamp"], zones["timestamp"]))
+		children = numpy.concatenate((self.open["children"], numpy.zeros(len(zones), numpy.int64)))
+
+		# number each (thread, level) pair, leaving a gap below every thread's
+		# lowest level so that one level up is always the previous pair
+		count = len(tids)
+		_, thread_ids = numpy.unique(tids, return_inverse=True)
+		level_offsets = levels - levels.min() + 1
+		pairs = thread_ids.astype(numpy.int64) * (int(level_offsets.max()) + 1) + level_offsets
+		pair_numbers, groups = numpy.unique(pairs, return_inverse=True)
+
+		# sort on (group, index), which fits in an int64 for any number of
+		# threads and levels as both are below the number of events
+		indices = numpy.arange(count, dtype=numpy.int64)
+		keys = groups * count + indices
+		order = numpy.argsort(keys)
+		sorted_keys = keys[order]
+		sorted_groups = groups[order]
+
+		paired = is_begin[order[:-1]] & ~is_begin[order[1:]] & (sorted_groups[:-1] == sorted_groups[1:])
+		begins = order[:-1][paired]
+		ends = order[1:][paired]
+		durations = timestamps[ends] - timestamps[begins]
+
+		# each zone's parent is the last begin one level up on the same thread
+		parent_pairs = pairs[begins] - 1
+		parent_groups = numpy.searchsorted(pair_numbers, parent_pairs)
+		has_parent = parent_groups < len(pair_numbers)
+		has_parent[has_parent] = pair_numbers[parent_groups[has_parent]] == parent_pairs[has_parent]
+		parent_slots = numpy.searchsorted(sorted_keys, parent_groups * count + indices[begins]) - 1
+		has_parent &= parent_slots >= 0
+		has_parent[has_parent] = sorted_groups[parent_slots[has_parent]] == parent_groups[has_parent]
+		numpy.add.at(children, order[parent_slots[has_parent]], durations[has_parent])
+
+		# begins left without an end stay open
+		still_open = is_begin.copy()
+		still_open[begins] = False
+		still_open = numpy.flatnonzero(still_open)
+		self.open = {
+			"tid": tids[still_open],
+			"level": levels[still_open],
+			"srcloc": srclocs[still_open],
+			"begin": positions[still_open],
+			"begin_timestamp": timestamps[still_open],
+			"children": children[still_open],
+		}
+
+		return {
+			"tid": tids[begins],
+			"level": levels[begins],
+			"srcloc": srclocs[begins],
+			"begin": positions[begins],
+			"end": positions[ends],
+			"begin_timestamp": timestamps[begins],
+			"end_timestamp": timestamps[ends],
+			"children": children[begins],
+		}
+
+FrameIndexVersion = 1
+
+class FrameIndex:
+	"""
+	Where every frame mark in a capture is, and which zones are open at each
+	one, so that a range of frames can be cut out of the capture without
+	reading the rest of it. Built in one pass over the file, then cached
+	next to the capture.
+	"""
+	def __init__(self, events_offset, event_count, positions, timestamps, stacks):
+		# byte offset of the first event, and how many events there are
+		self.events_offset = events_offset
+		self.event_count = event_count
+		# event position and timestamp of every frame mark
+		self.positions = positions
+		self.timestamps = timestamps
+		# zones open at each frame mark, sorted by (frame, tid, level)
+		self.stacks = stacks
+
+	@classmethod
+	def build(cls, fname):
+		with CaptureReader(fname) as reader:
+			events_offset = reader.events_offset
+			pairer = ZonePairer()
+			positions = numpy.zeros(0, numpy.int64)
+			timestamps = numpy.zeros(0, numpy.int64)
+			spans = []
+			for events in reader.chunks():
+				marks = numpy.flatnonzero(events["type"] == FileEventFrameMark)
+				positions = numpy.concatenate((positions, pairer.position + marks))
+				timestamps = numpy.concatenate((timestamps, events["timestamp"][marks]))
+				zones = pairer.add(events)
+				# every frame mark inside a zone has it on the stack
+				first = numpy.searchsorted(positions, zones["begin"], "right")
+				last = numpy.searchsorted(positions, zones["end"], "left")
+				spans.append((zones, first, last))
+			events = None
+
+			# zones which never end are open at every frame after they begin
+			zones = pairer.open
+			spans.append((zones, numpy.searchsorted(positions, zones["begin"], "right"), numpy.full(len(zones["begin"]), len(positions))))
+
+		stacks = {field: [] for field in ("frame", "tid", "level", "srcloc", "begin_timestamp")}
+		for zones, first, last in spans:
+			counts = numpy.maximum(last - first, 0)
+			spanning = numpy.flatnonzero(counts)
+			counts = counts[spanning]
+			starts = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+			stacks["frame"].append(numpy.repeat(first[spanning], counts) + numpy.arange(counts.sum()) - starts)
+			for field in ("tid", "level", "srcloc", "begin_timestamp"):
+				stacks[field].append(numpy.repeat(zones[field][spanning], counts))
+		stacks = {field: numpy.concatenate(arrays).astype(numpy.int64) for field, arrays in stacks.items()}
+		order = numpy.lexsort((stacks["level"], stacks["tid"], stacks["frame"]))
+		stacks = {field: array[order] for field, array in stacks.items()}
+
+		return cls(events_offset, pairer.position, positions, timestamps, stacks)
+
+	@staticmethod
+	def _cache_path(fname):
+		return f"{fname}.frames.npz"
+
+	@classmethod
+	def load(cls, fname):
+		"""
+		Load the cached index of a capture, building it if the cache is
+		missing or the capture has changed since.
+		"""
+		stat = os.stat(fname)
+		try:
+			with numpy.load(cls._cache_path(fname)) as data:
+				version, size, mtime, events_offset, event_count = data["meta"].tolist()
+				if (version, size, mtime) == (FrameIndexVersion, stat.st_size, stat.st_mtime_ns):
+					stacks = {field[len("stack_"):]: data[field] for field in data.files if field.startswith("stack_")}
+					return cls(events_offset, event_count, data["positions"], data["timestamps"], stacks)
+		except (OSError, KeyError, ValueError):
+			pass
+
+		index = cls.build(fname)
+		try:
+			with open(cls._cache_path(fname), "wb") as f:
+				numpy.savez(
+					f,
+					meta = numpy.array([FrameIndexVersion, stat.st_size, stat.st_mtime_ns, index.events_offset, index.event_count]),
+					positions = index.positions,
+					timestamps = index.timestamps,
+					**{f"stack_{field}": array for field, array in index.stacks.items()}
+				)
+		except OSError:
+			# not being able to cache it just makes the next run slower
+			pass
+		return index
+
+	def __len__(self):
+		return len(self.positions)
+
+	def open_at(self, frame):
+		"""
+		The zones open at the given frame mark, outermost first on each thread.
+		"""
+		first, last = numpy.searchsorted(self.stacks["frame"], (frame, frame + 1))
+		return {field: array[first:last] for field, array in self.stacks.items()}
+
+	def frames_between(self, start, end, multiplier):
+		"""
+		The first and last frame marks between two times, in seconds since the
+		first frame mark. Either time may be None to leave that side open.
+		"""
+		if not len(self.timestamps):
+			raise ValueError("the capture has no frame marks")
+		seconds = (self.timestamps - self.timestamps[0]) * multiplier / 1e9
+		first = 0 if start is None else int(numpy.searchsorted(seconds, start, "left"))
+		last = len(seconds) - 1 if end is None else int(numpy.searchsorted(seconds, end, "right")) - 1
+		return first, last
+
+	def read_slice(self, reader, first, last, chunk_size=EventChunkSize):
+		"""
+		Yield the events from frame mark `first` to frame mark `last`
+		inclusive, as views of the CaptureReader `reader` in chunks like
+		read_events(). Zones already open at the first frame mark are begun
+		at its timestamp, and zones still open at the last are ended at its
+		timestamp, so zone nesting stays balanced.
+		"""
+		yield _synthetic_zones(FileEventZoneBegin, self.open_at(first), self.timestamps[first])
+		yield from reader.chunks(int(self.positions[first]), int(self.positions[last]) + 1, chunk_size)
+		closing = {field: array[::-1] for field, array in self.open_at(last).items()}
+		yield _synthetic_zones(FileEventZoneEnd, closing, self.timestamps[last])
+
+def _synthetic_zones(event_type, zones, timestamp):
+	events = numpy.zeros(len(zones["tid"]), EventDtype)
+	events["type"] = event_type
+	events["tid"] = zones["tid"]
+	if event_type == FileEventZoneBegin:
+		events["srcloc"] = zones["srcloc"]
+	events["timestamp"] = timestamp
+	return events
+
+def add_slice_arguments(parser):
+	parser.add_argument("--from", dest="start", type=float, metavar="SECONDS", help="start at the first frame at or after this many seconds into the capture")
+	parser.add_argument("--to", dest="end", type=float, metavar="SECONDS", help="stop at the last frame at or before this many seconds into the capture")
+	parser.add_argument("--frames", metavar="FIRST:LAST", help="only use this range of frames, counting from 0, either end may be left out")
+
+def resolve_slice(args, fname, header):
+	"""
+	Turn parsed --from/--to/--frames arguments into the capture's FrameIndex
+	and an inclusive range of frame marks, or (None, None) if the whole
+	capture was asked for.
+	"""
+	if not args.frames and args.start is None and args.end is None:
+		return None, None
+
+	index = FrameIndex.load(fname)
+	if args.frames:
+		first, _, last = args.frames.partition(":")
+		first = int(first) if first else 0
+		last = int(last) if last else len(index) - 1
+	else:
+		first, last = index.frames_between(args.start, args.end, header.multiplier)
+
+	first = max(first, 0)
+	last = min(last, len(index) - 1)
+	if first > last:
+		raise ValueError("no frames in the requested range")
+	return index, (first, last)